@@ -0,0 +1,22 @@
+import argparse
+import sys
+
+import columns_benchmark
+import columns_replay
+import columns_simulation
+
+
+def main(argv: list[str] = None) -> int:
+    'Runs the command given on the command line, e.g. python -m columns simulate --games 100.'
+    parser = argparse.ArgumentParser(prog='columns', description='Run the Columns game engine without the GUI.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    columns_simulation.add_parser(subparsers)
+    columns_replay.add_parser(subparsers)
+    columns_benchmark.add_parser(subparsers)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
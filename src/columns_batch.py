@@ -0,0 +1,311 @@
+import numpy as np
+
+import columns_logic
+from columns_logic import ColumnDoesNotExist, ExpectedInputMismatch
+
+
+# Opcodes accepted by BatchColumnsGame.process_commands(), one per game.
+NO_COMMAND = -1
+TICK = 0
+ROTATE = 1
+MOVE_LEFT = 2
+MOVE_RIGHT = 3
+CREATE_FALLER = 4
+
+_EMPTY = columns_logic._EMPTY
+_COLOR_MASK = columns_logic._COLOR_MASK
+_MATCHED = columns_logic._MATCHED
+_NUM_COLORS = len(columns_logic._JEWELS)
+
+
+class BatchColumnsGame:
+    def __init__(self, count: int, rows: int, columns: int) -> None:
+        'Creates count games with the specified rows and columns that are stepped together.'
+        self._count = count
+        self._rows = rows
+        self._columns = columns
+
+        # Every board uses the same byte coding as ColumnsGame, including the
+        # three rows above the game field. The faller of each game is kept
+        # apart from its board and only merged in when a field is requested.
+        self._board = np.zeros((count, rows + 3, columns), dtype=np.uint8)
+        self._faller_active = np.zeros(count, dtype=bool)
+        self._faller_column = np.zeros(count, dtype=np.intp)
+        self._bottom_faller_row = np.zeros(count, dtype=np.intp)
+        self._faller_colors = np.zeros((count, 3), dtype=np.uint8)
+        self._faller_landed = np.zeros(count, dtype=bool)
+        self._faller_frozen = np.ones(count, dtype=bool)
+        self._game_over = np.zeros(count, dtype=bool)
+
+
+    def _games(self, games) -> np.ndarray:
+        'Returns the indices of the selected games, which may be given as a boolean mask or indices.'
+        if games is None:
+            return np.arange(self._count)
+        games = np.asarray(games)
+        if games.dtype == bool:
+            return np.flatnonzero(games)
+        return games.astype(np.intp, copy=False)
+
+
+    def place_contents(self, row: int, input_row: str, games=None) -> None:
+        'Places jewels at the specified row of the selected games at the beginning of the game.'
+        if len(input_row) != self._columns:
+            raise ExpectedInputMismatch('Input does not match number of columns!')
+        if any(character not in columns_logic._JEWEL_CODES and character != ' ' for character in input_row):
+            raise ExpectedInputMismatch('Input must include either only possible jewels or empty space!')
+
+        codes = [columns_logic._JEWEL_CODES.get(character, _EMPTY) for character in input_row]
+        self._board[self._games(games), row + 3] = codes
+
+
+    def process_commands(self, opcodes, columns=None, colors=None) -> None:
+        'Performs one command in every game, as ColumnsGame.process_command does for a single game.'
+        opcodes = np.asarray(opcodes)
+        for opcode, command in ((TICK, self._tick_command),
+                                (ROTATE, self.rotate_fallers),
+                                (MOVE_LEFT, self.move_fallers_left),
+                                (MOVE_RIGHT, self.move_fallers_right)):
+            games = np.flatnonzero(opcodes == opcode)
+            if games.size:
+                command(games)
+
+        games = np.flatnonzero(opcodes == CREATE_FALLER)
+        if games.size:
+            self.create_fallers(np.asarray(columns)[games], np.asarray(colors)[games], games)
+
+
+    def _tick_command(self, games) -> None:
+        'Removes matching jewels and drops everything once in the selected games.'
+        self.remove_matching(games)
+        self.drop_once(games)
+
+
+    def tick(self) -> None:
+        'Runs one game tick in every game that is not over: gravity, match checks and the game over check.'
+        games = np.flatnonzero(~self._game_over)
+        self._tick_command(games)
+        self.check_matches(games)
+        self.check_game_over(games)
+
+
+    def create_fallers(self, columns, colors, games=None) -> None:
+        'Creates a faller in each selected game from a 0-based column and three color codes (1-7, top first).'
+        games = self._games(games)
+        columns = np.asarray(columns, dtype=np.intp)
+        colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        if np.any((columns < 0) | (columns >= self._columns)):
+            raise ColumnDoesNotExist('Column does not exist in the game field!')
+        if np.any((colors < 1) | (colors > _NUM_COLORS)):
+            raise ExpectedInputMismatch('One of the specified jewels does not exist!')
+
+        allowed = ~self._faller_active[games] & ~self._any_matched(games)
+        games = games[allowed]
+        columns = columns[allowed]
+
+        self._faller_active[games] = True
+        self._faller_frozen[games] = False
+        self._faller_landed[games] = False
+        self._faller_column[games] = columns
+        self._bottom_faller_row[games] = 2
+        self._faller_colors[games] = colors[allowed]
+        self._game_over[games] |= self._board[games, 3, columns] != _EMPTY
+        self.drop_once(games)
+
+
+    def spawn_random_fallers(self, rng: np.random.Generator) -> None:
+        'Creates a random faller in a random free column in every game that is waiting for one.'
+        games = np.flatnonzero(~self._game_over & ~self._faller_active)
+        games = games[~self._any_matched(games)]
+        if not games.size:
+            return
+
+        free = self._board[games, 3] == _EMPTY
+        priorities = rng.random(free.shape) + free
+        columns = priorities.argmax(axis=1)
+        colors = rng.integers(1, _NUM_COLORS + 1, size=(games.size, 3), dtype=np.uint8)
+
+        # As in ColumnsGame.create_random_faller, a full top row gets an
+        # 'F 1 S T V' faller, which ends the game.
+        full = ~free.any(axis=1)
+        columns[full] = 0
+        colors[full] = (1, 2, 3)
+        self.create_fallers(columns, colors, games)
+
+
+    def _any_matched(self, games: np.ndarray) -> np.ndarray:
+        'Returns whether each selected game has jewels marked as matched.'
+        return (self._board[games] & _MATCHED).any(axis=(1, 2))
+
+
+    def drop_once(self, games=None) -> np.ndarray:
+        'Drops all jewels once in the selected games, and returns whether anything dropped in each game.'
+        games = self._games(games)
+        board = self._board[games]
+
+        # A jewel falls one row whenever there is an empty cell anywhere below
+        # it, since everything beneath it falls along with it.
+        empty = board == _EMPTY
+        empty_below = np.zeros_like(empty)
+        empty_below[:, :-1] = np.logical_or.accumulate(empty[:, :0:-1], axis=1)[:, ::-1]
+        moving = ~empty & empty_below
+
+        dropped = board.copy()
+        dropped[moving] = _EMPTY
+        dropped[:, 1:][moving[:, :-1]] = board[:, :-1][moving[:, :-1]]
+        self._board[games] = dropped
+        jewels_dropped = moving.any(axis=(1, 2))
+
+        faller = self._faller_active[games]
+        if faller.any():
+            positions = np.flatnonzero(faller)
+            fallers = games[positions]
+            columns = self._faller_column[fallers]
+            bottoms = self._bottom_faller_row[fallers]
+            moved = empty_below[positions, bottoms, columns]
+            bottoms = bottoms + moved
+            self._bottom_faller_row[fallers] = bottoms
+            jewels_dropped[positions] |= moved
+
+            below = np.minimum(bottoms + 1, self._rows + 2)
+            blocked = (bottoms + 1 > self._rows + 2) | (dropped[positions, below, columns] != _EMPTY)
+            self._faller_landed[fallers[moved & blocked]] = True
+
+            # As in ColumnsGame, a landed faller only freezes, and a stopped one
+            # only lands, on a tick where nothing else in its game dropped.
+            landed = self._faller_landed[fallers]
+            still = ~jewels_dropped[positions]
+            self._freeze(fallers[still & landed])
+            self._faller_landed[fallers[still & ~landed]] = True
+
+        return jewels_dropped
+
+
+    def drop_jewels(self, games=None) -> None:
+        'Pulls all jewels as far down as possible in the selected games.'
+        games = self._games(games)
+        board = self._board[games]
+        order = np.argsort(board != _EMPTY, axis=1, kind='stable')
+        self._board[games] = np.take_along_axis(board, order, axis=1)
+
+
+    def _freeze(self, games: np.ndarray) -> None:
+        'Freezes the fallers of the selected games into their boards.'
+        if not games.size:
+            return
+        columns = self._faller_column[games]
+        bottoms = self._bottom_faller_row[games]
+        for offset in range(3):
+            self._board[games, bottoms - 2 + offset, columns] = self._faller_colors[games, offset]
+        self._faller_active[games] = False
+        self._faller_frozen[games] = True
+
+
+    def rotate_fallers(self, games=None) -> None:
+        'Rotates the faller of each selected game.'
+        games = self._games(games)
+        games = games[self._faller_active[games]]
+        self._faller_colors[games] = self._faller_colors[games][:, [2, 0, 1]]
+
+
+    def move_fallers_left(self, games=None) -> None:
+        'Moves the faller of each selected game to the left if possible.'
+        self._shift_fallers(self._games(games), -1)
+
+
+    def move_fallers_right(self, games=None) -> None:
+        'Moves the faller of each selected game to the right if possible.'
+        self._shift_fallers(self._games(games), 1)
+
+
+    def _shift_fallers(self, games: np.ndarray, offset: int) -> None:
+        'Moves the faller of each selected game sideways if the neighboring cells are empty.'
+        games = games[self._faller_active[games]]
+        targets = self._faller_column[games] + offset
+        inside = (targets >= 0) & (targets < self._columns)
+        games = games[inside]
+        targets = targets[inside]
+
+        bottoms = self._bottom_faller_row[games]
+        rows = bottoms[:, None] - np.arange(3)
+        free = (self._board[games[:, None], rows, targets[:, None]] == _EMPTY).all(axis=1)
+        games = games[free]
+        targets = targets[free]
+        bottoms = bottoms[free]
+        self._faller_column[games] = targets
+
+        below = np.arange(self._rows + 3) > bottoms[:, None]
+        space = (below & (self._board[games, :, targets] == _EMPTY)).any(axis=1)
+        self._faller_landed[games] = ~space
+
+
+    def remove_matching(self, games=None) -> None:
+        'Removes all jewels marked as matched in the selected games and drops the rest.'
+        games = self._games(games)
+        games = games[self._any_matched(games)]
+        if not games.size:
+            return
+        board = self._board[games]
+        board[board & _MATCHED != 0] = _EMPTY
+        self._board[games] = board
+        self.drop_jewels(games)
+
+
+    def check_matches(self, games=None) -> None:
+        'Marks three or more matching jewels in any direction in the selected games with frozen fallers.'
+        games = self._games(games)
+        games = games[self._faller_frozen[games]]
+        board = self._board[games]
+        colors = board & _COLOR_MASK
+        matched = np.zeros(board.shape, dtype=bool)
+
+        rows, columns = colors.shape[1:]
+        for row_step, col_step in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            height = rows - 2 * row_step
+            width = columns - 2 * abs(col_step)
+            if height <= 0 or width <= 0:
+                continue
+            first_col = 2 if col_step < 0 else 0
+            cells = [colors[:, row_step * i:row_step * i + height, first_col + col_step * i:first_col + col_step * i + width]
+                     for i in range(3)]
+            run = (cells[0] != _EMPTY) & (cells[0] == cells[1]) & (cells[1] == cells[2])
+            for i in range(3):
+                matched[:, row_step * i:row_step * i + height, first_col + col_step * i:first_col + col_step * i + width] |= run
+
+        self._board[games] = board | (matched * _MATCHED).astype(np.uint8)
+
+
+    def check_game_over(self, games=None) -> None:
+        'Ends each selected game whose faller is frozen and does not fit on the field.'
+        games = self._games(games)
+        games = games[self._faller_frozen[games] & ~self._any_matched(games)]
+        self._game_over[games] |= (self._board[games, :3] != _EMPTY).any(axis=(1, 2))
+
+
+    def game_over(self) -> np.ndarray:
+        'Returns a boolean array representing whether each game is over or not.'
+        return self._game_over.copy()
+
+
+    def count(self) -> int:
+        'Returns the number of games in the batch.'
+        return self._count
+
+
+    def boards(self) -> np.ndarray:
+        'Returns a read-only view of the boards without fallers, as (games, rows + 3, columns) cell codes.'
+        view = self._board.view()
+        view.flags.writeable = False
+        return view
+
+
+    def field(self, game: int) -> list[list]:
+        'Returns the 2D list representing the field of one game, as ColumnsGame.field() does.'
+        field = [[columns_logic._CELL_STRINGS[cell] for cell in row] for row in self._board[game].tolist()]
+        if self._faller_active[game]:
+            column = self._faller_column[game]
+            bottom = self._bottom_faller_row[game]
+            left, right = '||' if self._faller_landed[game] else '[]'
+            for offset, color in enumerate(self._faller_colors[game].tolist()):
+                field[bottom - 2 + offset][column] = f'{left}{columns_logic._JEWELS[color - 1]}{right}'
+        return field
@@ -0,0 +1,315 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+
+import columns_logic
+import columns_simulation
+
+
+# Board sizes are given as columns x rows.
+DEFAULT_SIZES = [(6, 13), (20, 40), (60, 120), (200, 400)]
+PATTERNS = ['empty', 'random', 'near_full', 'one_color']
+
+_SEED = 'benchmark'
+# Rows left empty at the top of the game field by the near_full and
+# one_color patterns, so that a faller still has room to appear.
+_FREE_ROWS = 2
+_FULL_GAME_TICKS = 2000
+# Cases that time whole ticks or games rather than a single method.
+_GAME_CASES = ['tick', 'full_game']
+
+
+def fill_rows(pattern: str, rows: int, columns: int, rng: random.Random) -> list[str]:
+    'Returns the rows of jewels to place with place_contents() for the given fill pattern.'
+    if pattern == 'empty':
+        return [' ' * columns] * rows
+    if pattern == 'random':
+        # The bottom half of the field, with holes that leave jewels floating.
+        return [' ' * columns if row < rows // 2 else
+                ''.join(rng.choice(columns_logic._JEWELS) if rng.random() < 0.8 else ' ' for _ in range(columns))
+                for row in range(rows)]
+    if pattern == 'near_full':
+        return [' ' * columns if row < _FREE_ROWS else ''.join(rng.choices(columns_logic._JEWELS, k=columns))
+                for row in range(rows)]
+    if pattern == 'one_color':
+        return [' ' * columns if row < _FREE_ROWS else 'S' * columns for row in range(rows)]
+    raise ValueError(f'Unknown fill pattern {pattern!r}!')
+
+
+def make_game(rows: int, columns: int, pattern: str) -> columns_logic.ColumnsGame:
+    'Creates a game whose field is filled with the given pattern.'
+    rng = random.Random(f'{_SEED}:{columns}x{rows}:{pattern}')
+    game = columns_logic.ColumnsGame(rows, columns, rng)
+    for row, contents in enumerate(fill_rows(pattern, rows, columns, rng)):
+        game.place_contents(row, contents)
+    return game
+
+
+def _marked(game: columns_logic.ColumnsGame) -> None:
+    'Marks the matching jewels of the game, so that remove_matching() has something to remove.'
+    game.check_horizontal_match()
+    game.check_vertical_match()
+    game.check_diagonal_match()
+
+
+def _resolved(game: columns_logic.ColumnsGame) -> None:
+    'Clears every match and lets the jewels settle, so that a new faller can be created.'
+    game.resolve()
+    game.drop_jewels()
+
+
+def _fallers_drawn(game: columns_logic.ColumnsGame) -> None:
+    '''Settles the field and draws the next block of random fallers, so that the snapshot does not leave
+    every timed create_random_faller() call to draw a whole block.'''
+    _resolved(game)
+    game._generate_fallers()
+
+
+def _with_faller(game: columns_logic.ColumnsGame) -> None:
+    'Settles the field and creates a faller in the middle column.'
+    _resolved(game)
+    game.execute(columns_logic.Command(columns_logic.Opcode.FALLER, game.columns() // 2 + 1, (1, 2, 3)))
+
+
+# Each case is a setup run once on a new game and the method that is timed.
+# The game is restored to the state left by the setup before every call.
+CASES = {
+    'drop_once': (None, 'drop_once'),
+    'drop_jewels': (None, 'drop_jewels'),
+    'check_horizontal_match': (None, 'check_horizontal_match'),
+    'check_vertical_match': (None, 'check_vertical_match'),
+    'check_diagonal_match': (None, 'check_diagonal_match'),
+    'remove_matching': (_marked, 'remove_matching'),
+    'create_random_faller': (_fallers_drawn, 'create_random_faller'),
+    'move_faller_left': (_with_faller, 'move_faller_left'),
+    'move_faller_right': (_with_faller, 'move_faller_right'),
+    'field': (None, 'field'),
+    'game_field': (None, 'game_field'),
+}
+
+
+def time_case(game: columns_logic.ColumnsGame, case: str, min_time: float, repeat: int) -> tuple[float, int]:
+    'Returns the best time of one call of the case over several rounds, and the number of calls timed per round.'
+    setup, method = CASES[case]
+    if setup != None:
+        setup(game)
+    snapshot = game.snapshot()
+    call = getattr(game, method)
+    restore = game.restore
+    clock = time.perf_counter
+
+    # Every call is timed on its own, since it has to start from the same
+    # state; the first round finds how many calls fill min_time.
+    calls = None
+    best = None
+    for _ in range(repeat):
+        total = 0.0
+        count = 0
+        while count < calls if calls != None else total < min_time:
+            restore(snapshot)
+            start = clock()
+            call()
+            total += clock() - start
+            count += 1
+        calls = count
+        best = total / count if best == None else min(best, total / count)
+    return best, calls
+
+
+def time_ticks(rows: int, columns: int, pattern: str, min_time: float, repeat: int) -> tuple[float, int, dict]:
+    '''Returns the mean time of one logic tick as ColumnsGUI.run does it, with random fallers and no moves, the
+    number of ticks timed, and their 99th percentile and maximum time.'''
+    game = make_game(rows, columns, pattern)
+    _resolved(game)
+    snapshot = game.snapshot()
+    clock = time.perf_counter
+
+    # Ticks are timed one by one, so that a single slow tick shows up in the
+    # percentiles, and the game starts over from the snapshot when it ends.
+    times = []
+    total = 0.0
+    while total < min_time * repeat:
+        start = clock()
+        game.process_command('')
+        game.check_horizontal_match()
+        game.check_vertical_match()
+        game.check_diagonal_match()
+        game.check_game_over()
+        if not game.game_over():
+            game.create_random_faller()
+        seconds = clock() - start
+        times.append(seconds)
+        total += seconds
+        if game.game_over():
+            game.restore(snapshot)
+
+    times.sort()
+    return total / len(times), len(times), {'p99': times[int(0.99 * (len(times) - 1))], 'max': times[-1]}
+
+
+def time_full_game(rows: int, columns: int, min_time: float, repeat: int) -> tuple[float, int]:
+    'Returns the best time of one tick over several rounds of headless games with the random policy.'
+    best = None
+    ticks = 0
+    for round_number in range(repeat):
+        total = 0.0
+        ticks = 0
+        game_number = 0
+        while total < min_time:
+            seed = f'{_SEED}-{round_number}-{game_number}'
+            start = time.perf_counter()
+            result = columns_simulation.play_game(rows, columns, columns_simulation.random_policy, seed,
+                                                  _FULL_GAME_TICKS)
+            total += time.perf_counter() - start
+            ticks += result['ticks']
+            game_number += 1
+        best = total / ticks if best == None else min(best, total / ticks)
+    return best, ticks
+
+
+def run_benchmarks(sizes: list[tuple[int, int]], patterns: list[str], cases: list[str],
+                   min_time: float, repeat: int, progress=None) -> list[dict]:
+    'Times every case on every board size and fill pattern, and returns one result for each.'
+    # As with timeit, the garbage collector is off while timing, so that its
+    # pauses do not land on whichever call happens to trigger them.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _run_benchmarks(sizes, patterns, cases, min_time, repeat, progress)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _run_benchmarks(sizes: list[tuple[int, int]], patterns: list[str], cases: list[str],
+                    min_time: float, repeat: int, progress) -> list[dict]:
+    'Times every case on every board size and fill pattern with the garbage collector off.'
+    results = []
+    for columns, rows in sizes:
+        for case in cases:
+            if case == 'full_game':
+                seconds, calls = time_full_game(rows, columns, min_time, repeat)
+                results.append(_result(case, columns, rows, 'empty', seconds, calls))
+                if progress != None:
+                    progress(results[-1])
+                continue
+            for pattern in patterns:
+                extra = {}
+                if case == 'tick':
+                    seconds, calls, extra = time_ticks(rows, columns, pattern, min_time, repeat)
+                else:
+                    seconds, calls = time_case(make_game(rows, columns, pattern), case, min_time, repeat)
+                results.append(_result(case, columns, rows, pattern, seconds, calls, **extra))
+                if progress != None:
+                    progress(results[-1])
+    return results
+
+
+def _result(case: str, columns: int, rows: int, pattern: str, seconds: float, calls: int, **extra) -> dict:
+    'Returns the result of one benchmark as written to the results file, with any extra timings of the case.'
+    return dict({'case': case, 'size': f'{columns}x{rows}', 'pattern': pattern, 'seconds': seconds, 'calls': calls},
+                **extra)
+
+
+def _key(result: dict) -> tuple[str, str, str]:
+    'Returns what identifies a benchmark across results files.'
+    return result['case'], result['size'], result['pattern']
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    '''Returns the results that are also in the baseline, each with its ratio to the baseline time and
+    whether it is faster, slower or within the threshold of it.'''
+    baseline_times = {_key(result): result['seconds'] for result in baseline}
+    comparisons = []
+    for result in results:
+        old_seconds = baseline_times.get(_key(result))
+        if old_seconds == None:
+            continue
+        ratio = result['seconds'] / old_seconds
+        if ratio > 1 + threshold:
+            verdict = 'slower'
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        comparisons.append(dict(result, baseline=old_seconds, ratio=ratio, verdict=verdict))
+    return comparisons
+
+
+def _format_time(seconds: float) -> str:
+    'Returns a time with a unit that suits its size.'
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.2f} us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds:.2f} s'
+
+
+def _parse_size(text: str) -> tuple[int, int]:
+    'Parses a board size given as COLUMNSxROWS.'
+    columns, rows = text.lower().split('x')
+    return int(columns), int(rows)
+
+
+def _name_list(choices: list[str], kind: str):
+    'Returns an argparse type that parses a comma separated list of names, each one of the given choices.'
+    def parse(text: str) -> list[str]:
+        names = text.split(',')
+        for name in names:
+            if name not in choices:
+                raise argparse.ArgumentTypeError(f'unknown {kind} {name!r}')
+        return names
+    return parse
+
+
+def add_parser(subparsers) -> None:
+    'Adds the benchmark command to the given argparse subparsers.'
+    parser = subparsers.add_parser('benchmark', help='time the game engine and compare with a saved baseline')
+    parser.add_argument('--sizes', type=lambda text: [_parse_size(size) for size in text.split(',')],
+                        default=DEFAULT_SIZES, help='comma separated COLUMNSxROWS board sizes (default: %(default)s)')
+    parser.add_argument('--patterns', type=_name_list(PATTERNS, 'fill pattern'), default=PATTERNS,
+                        help=f'comma separated fill patterns out of {", ".join(PATTERNS)}; the full_game case '
+                             'always starts empty')
+    parser.add_argument('--cases', type=_name_list(list(CASES) + _GAME_CASES, 'benchmark case'),
+                        default=list(CASES) + _GAME_CASES,
+                        help=f'comma separated cases out of {", ".join(list(CASES) + _GAME_CASES)}')
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds each round of a case runs for')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds per case; the best one is kept')
+    parser.add_argument('--output', help='file to write the results to as JSON, or - for standard output')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change in time that counts as faster or slower (default: %(default)s)')
+    parser.set_defaults(run=run)
+
+
+def run(args) -> int:
+    'Runs the benchmark command with parsed command line arguments; fails if any case got slower than the baseline.'
+    # Progress goes to standard error so the results can go to standard output.
+    def progress(result: dict) -> None:
+        extra = ''.join(f'  {name} {_format_time(result[name])}' for name in ('p99', 'max') if name in result)
+        print(f'{result["case"]:<24} {result["size"]:>8} {result["pattern"]:<10} {_format_time(result["seconds"]):>12}'
+              f'{extra}', file=sys.stderr)
+
+    results = run_benchmarks(args.sizes, args.patterns, args.cases, args.min_time, args.repeat, progress)
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    elif args.output != None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1)
+
+    if args.baseline == None:
+        return 0
+    with open(args.baseline) as baseline:
+        comparisons = compare(results, json.load(baseline)['results'], args.threshold)
+    print(file=sys.stderr)
+    for comparison in comparisons:
+        print(f'{comparison["case"]:<24} {comparison["size"]:>8} {comparison["pattern"]:<10} '
+              f'{_format_time(comparison["baseline"]):>12} -> {_format_time(comparison["seconds"]):>12} '
+              f'{comparison["ratio"]:6.2f}x {comparison["verdict"]}', file=sys.stderr)
+    return 1 if any(comparison['verdict'] == 'slower' for comparison in comparisons) else 0
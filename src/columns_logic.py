@@ -1,4 +1,120 @@
+import copy
+import enum
+import functools
 import random
+import re
+from typing import NamedTuple
+
+
+# Each cell of the field is stored as a single byte. The low three bits hold
+# the jewel color (0 for an empty cell, 1-7 for S through Z) and the high bits
+# hold the state of the jewel. The field only holds frozen jewels; the faller
+# flags are used when the faller is merged into a view of the field.
+_EMPTY = 0
+_COLOR_MASK = 0x07
+_MATCHED = 0x08
+_FALLER = 0x10
+_LANDED = 0x20
+
+_JEWELS = 'STVWXYZ'
+_JEWEL_CODES = {jewel: code for code, jewel in enumerate(_JEWELS, start=1)}
+
+_JEWEL_CODE_LIST = tuple(_JEWEL_CODES.values())
+
+# Small enough that drawing a block stays well under a millisecond.
+_FALLERS_PER_BLOCK = 256
+# The faller made when no column has room for a new one, as 'F 1 S T V'.
+_FULL_FIELD_FALLER = (1, 2, 3)
+
+
+def _cell_string(cell: int) -> str:
+    'Returns the three character string used to display the given cell.'
+    if cell == _EMPTY:
+        return '   '
+    jewel = _JEWELS[(cell & _COLOR_MASK) - 1]
+    if cell & _MATCHED:
+        return f'*{jewel}*'
+    if cell & _FALLER and cell & _LANDED:
+        return f'|{jewel}|'
+    if cell & _FALLER:
+        return f'[{jewel}]'
+    return f' {jewel} '
+
+
+def _translation(function) -> bytes:
+    'Returns a table for bytearray.translate() mapping every cell through the given function.'
+    return bytes(function(cell) & 0xFF for cell in range(256))
+
+
+_CELL_STRINGS = [_cell_string(cell) for cell in range(64)]
+
+_NOT_EMPTY = re.compile(b'[^\\x00]')
+
+
+def _nonzero_indices(data: bytes) -> list[int]:
+    'Returns the index of every byte that is not zero.'
+    return [match.start() for match in _NOT_EMPTY.finditer(data)]
+
+
+# Matches are found with one bitboard per jewel color. Every cell of the field
+# takes up one byte of the bitboard, so a line of three cells in a direction is
+# found by shifting the bitboard by that direction's step and ANDing.
+_HORIZONTAL = 0
+_VERTICAL = 1
+_RIGHT_DOWN = 2
+_LEFT_DOWN = 3
+_ALL_DIRECTIONS = (_HORIZONTAL, _VERTICAL, _RIGHT_DOWN, _LEFT_DOWN)
+_ALL_CHECKS = (1 << len(_ALL_DIRECTIONS)) - 1
+
+_COLOR_BITS = [_translation(lambda cell, color=color: 1 if cell & _COLOR_MASK == color else 0)
+               for color in range(1, len(_JEWELS) + 1)]
+
+
+@functools.lru_cache(maxsize=256)
+def _line_directions(width: int, height: int) -> tuple[tuple[int, int], ...]:
+    'Returns the bit shift and the mask of cells a line can start from for each direction.'
+    def starts(first_col: int, stop_col: int) -> int:
+        row = bytes(1 if first_col <= col < stop_col else 0 for col in range(width))
+        return int.from_bytes(row * height, 'little')
+
+    return ((8, starts(0, width - 2)),
+            (8 * width, starts(0, width)),
+            (8 * (width + 1), starts(0, width - 2)),
+            (8 * (width - 1), starts(2, width)))
+
+
+def _matching_cells(cells: bytes, width: int, directions: tuple[int, ...]) -> int:
+    'Returns a mask with a one byte for every cell in a line of three or more jewels of the same color.'
+    lines = _line_directions(width, len(cells) // width)
+    matched = 0
+    for table in _COLOR_BITS:
+        board = int.from_bytes(cells.translate(table), 'little')
+        if not board:
+            continue
+        for direction in directions:
+            shift, starts = lines[direction]
+            run = board & (board >> shift) & (board >> 2 * shift) & starts
+            if run:
+                matched |= run | (run << shift) | (run << 2 * shift)
+    return matched
+
+
+# The Zobrist hash of a field is the XOR of one random 64-bit key per cell,
+# chosen by the cell's index and its byte. Keys are made on demand by mixing
+# those two numbers with SplitMix64, so no table the size of the field is
+# needed, and an empty cell's key is 0.
+_HASH_MASK = (1 << 64) - 1
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _zobrist_key(index: int, cell: int) -> int:
+    'Returns the Zobrist key of the given cell byte at the given index of the field.'
+    if cell == _EMPTY:
+        return 0
+    key = ((index << 6 | cell) + 0x9E3779B97F4A7C15) & _HASH_MASK
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & _HASH_MASK
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & _HASH_MASK
+    return key ^ (key >> 31)
 
 
 class ColumnDoesNotExist(Exception):
@@ -8,12 +124,78 @@ class ExpectedInputMismatch(Exception):
     pass
 
 
+class Opcode(enum.IntEnum):
+    'The commands understood by ColumnsGame.execute().'
+    TICK = 0
+    ROTATE = 1
+    LEFT = 2
+    RIGHT = 3
+    FALLER = 4
+    QUIT = 5
+
+
+class Command(NamedTuple):
+    'A parsed command. A FALLER command also has a column (1-based) and three jewel codes (1-7 for S-Z, top first).'
+    opcode: Opcode
+    column: int = 0
+    jewels: tuple[int, ...] = ()
+
+
+_TEXT_COMMANDS = {
+    '': Command(Opcode.TICK),
+    'R': Command(Opcode.ROTATE),
+    '<': Command(Opcode.LEFT),
+    '>': Command(Opcode.RIGHT),
+    'Q': Command(Opcode.QUIT),
+}
+
+
+# Commands come in one line at a time, and most of them are repeated many
+# times over a game, so parsed commands are cached by their text.
+@functools.lru_cache(maxsize=4096)
+def parse_command(text: str) -> Command:
+    'Parses a text command as accepted by ColumnsGame.process_command().'
+    command = _TEXT_COMMANDS.get(text)
+    if command != None:
+        return command
+    if not text.startswith('F'):
+        raise ExpectedInputMismatch('Command does not exist!')
+    return _parse_faller(text)
+
+
+def _parse_faller(text: str) -> Command:
+    '''Parses an F command. A column that is not a number is given as 0 and unknown jewels the code of an empty
+    cell, so that, as before, they are only rejected when a faller can be created.'''
+    words = text.split()
+    if len(words) != 5 or words[0] != 'F':
+        raise ExpectedInputMismatch('Command does not exist!')
+    column = int(words[1]) if words[1].isdecimal() else 0
+    return Command(Opcode.FALLER, column, tuple(_JEWEL_CODES.get(jewel, _EMPTY) for jewel in words[2:]))
+
+
+class PlacementResult(NamedTuple):
+    'The outcome of ColumnsGame.place(): the number of jewels cleared in each step of the chain, and whether the game is over.'
+    chains: list[int]
+    game_over: bool
+
+
+class CellChange(NamedTuple):
+    'A cell of ColumnsGame.field() that changed, with its row, column and old and new state (e.g. \'   \' and \'[S]\').'
+    row: int
+    column: int
+    old: str
+    new: str
+
+
 
 class ColumnsGame:
-    def __init__(self, rows: int, columns: int) -> None:
-        'Creates a game with the specified rows and columns, and an empty field.'
+    def __init__(self, rows: int, columns: int, seed: int | str | random.Random = None) -> None:
+        '''Creates a game with the specified rows and columns, and an empty field. Random fallers come from
+        the given seed or random.Random instance.'''
         self._rows = rows
         self._columns = columns
+        # The faller is kept apart from the field as the codes of its three
+        # jewels (top first), its column and the row of its bottom jewel.
         self._faller = None
         self._bottom_faller_row = None
         self._faller_column = None
@@ -21,15 +203,47 @@ class ColumnsGame:
         self._faller_frozen = True
         self._game_over = False
 
-        self._field = []
-        for i in range(3):
-            self._field.append([])
-            for j in range(self._columns):
-                self._field[-1].append('   ')
-        for i in range(rows):
-            self._field.append([])
-            for j in range(columns):
-                self._field[-1].append('   ')
+        # The field is stored row by row in a flat bytearray, including the
+        # three rows above the game field where new fallers appear.
+        self._cells = bytearray((rows + 3) * columns)
+        self._hash = 0
+        self._reset_touched()
+
+        # The row of the highest frozen jewel in each column (rows + 3 when the
+        # column is empty), and the columns that may have empty cells below
+        # some of their jewels.
+        self._tops = [rows + 3] * columns
+        self._unsettled = set()
+        # The number of columns with jewels above the game field.
+        self._overflowing = 0
+
+        # The columns whose first visible row is empty, in no particular
+        # order, and the position of each column in that list (or -1).
+        self._free_columns = list(range(columns))
+        self._free_positions = list(range(columns))
+
+        # The indices of the jewels that are marked as matched.
+        self._matched = []
+
+        # While undo points are set, the old value of every changed cell is
+        # recorded so that undo() can put it back.
+        self._undo_points = []
+        self._undo_log = None
+
+        # Once consume_changes() has been called, the cells that change are
+        # recorded with the value they had at the last call, along with the
+        # cells the faller was shown on then.
+        self._changes = None
+        self._faller_cells = {}
+
+        # Random fallers are generated in blocks: the jewels of every faller
+        # in the block and a number in [0, 1) that picks its column. The
+        # state of the random generator after the block is kept so that
+        # restoring an earlier state also restores the fallers to come.
+        self._random = seed if isinstance(seed, random.Random) else random.Random(seed)
+        self._upcoming_fallers = None
+        self._next_faller = _FALLERS_PER_BLOCK
+        self._random_state = self._random.getstate()
 
 
     def place_contents(self, row: int, input_row: str) -> None:
@@ -37,352 +251,693 @@ class ColumnsGame:
         possible_jewels = ['S', 'T', 'V', 'W', 'X', 'Y', 'Z', ' ']
         if len(input_row) != self._columns:
             raise ExpectedInputMismatch('Input does not match number of columns!')
-        
+
         for character in input_row:
             if character not in possible_jewels:
                 raise ExpectedInputMismatch(f'Input must include either only possible jewels or empty space!')
-        
+
         row += 3
+        start = row * self._columns
         for col in range(self._columns):
-            self._field[row][col] = f' {input_row[col]} '
-
-    
-    def drop_jewels(self) -> None:
-        'Pulls all jewels as far down as possible.'
-        jewels_dropped = False
-        jewels_dropped = self.drop_once()
-        if jewels_dropped:
-            self.drop_jewels()
+            self._write(start + col, _JEWEL_CODES.get(input_row[col], _EMPTY))
+            if input_row[col] != ' ':
+                self._set_top(col, min(self._tops[col], row))
+                self._unsettled.add(col)
+            elif row == self._tops[col]:
+                self._update_top(col)
+        self._touch(row, 0)
+        self._touch(row, self._columns - 1)
+
+
+    def drop_jewels(self) -> list[tuple[int, int, int]]:
+        'Pulls all jewels as far down as possible, and returns the column, old row and new row of every jewel that moved.'
+        columns = self._unsettled
+        if self._faller != None:
+            columns.add(self._faller_column)
+        moved = []
+        for col in columns:
+            moved.extend(self._settle_column(col))
+        self._unsettled = set()
+
+        if self._faller != None:
+            landing_row = self._tops[self._faller_column] - 1
+            if landing_row > self._bottom_faller_row:
+                self._bottom_faller_row = landing_row
+                self._faller_landed = True
+            self.drop_once()
+        return moved
+
+
+    def _settle_column(self, col: int) -> list[tuple[int, int, int]]:
+        'Moves the jewels of a column down over any empty cells in one pass, and returns the moves made.'
+        columns = self._columns
+        column = self._cells[col::columns]
+        stack = column.lstrip(b'\x00')
+        if _EMPTY not in stack:
+            self._update_top(col)
+            return []
+
+        # Jewels below the lowest empty cell stay where they are; every
+        # jewel above it moves down to the next free row, keeping its order.
+        moved = []
+        target = column.rindex(_EMPTY)
+        for row in range(target - 1, len(column) - len(stack) - 1, -1):
+            cell = column[row]
+            if cell != _EMPTY:
+                self._write(row * columns + col, _EMPTY)
+                self._write(target * columns + col, cell)
+                self._touch(target, col)
+                moved.append((col, row, target))
+                target -= 1
+        self._update_top(col)
+        return moved
+
+
+    def _update_top(self, col: int) -> None:
+        'Finds the highest frozen jewel of the given column again.'
+        column = self._cells[col::self._columns]
+        self._set_top(col, len(column) - len(column.lstrip(b'\x00')))
+
+
+    def _set_top(self, col: int, top: int) -> None:
+        'Changes the row of the highest frozen jewel in a column, keeping the free and overflowing columns up to date.'
+        old_top = self._tops[col]
+        was_free = old_top > 3
+        self._tops[col] = top
+        if (old_top < 3) != (top < 3):
+            self._overflowing += 1 if top < 3 else -1
+        if top > 3 and not was_free:
+            self._free_positions[col] = len(self._free_columns)
+            self._free_columns.append(col)
+        elif top <= 3 and was_free:
+            position = self._free_positions[col]
+            last = self._free_columns.pop()
+            if last != col:
+                self._free_columns[position] = last
+                self._free_positions[last] = position
+            self._free_positions[col] = -1
 
 
     def process_command(self, command: str) -> None:
         'Performs actions in the game according to the given command.'
-        possible_commands = ['', 'R', '<', '>', 'Q']
-        if command in possible_commands or (command.startswith('F') and len(command) == 9):
-            pass
+        self.execute(parse_command(command))
+
+
+    def execute(self, command: Command, trusted: bool = False) -> None:
+        '''Performs a parsed command. Trusted commands, such as those made by a program, skip checking that
+        the column and jewels of a new faller exist.'''
+        if command.opcode == Opcode.FALLER:
+            self._create_faller(command.column - 1, command.jewels, trusted)
         else:
-            raise ExpectedInputMismatch('Command does not exist!')
-        
-        if command == '':
-            self.remove_matching()
-            self.drop_once()
-        if command.startswith('F'):
-            self.create_faller(command)
-        if command == 'R':
-            self.rotate_faller()
-        if command == '<':
-            self.move_faller_left()
-        if command == '>':
-            self.move_faller_right()
-        if command == 'Q':
-            quit()
+            self._COMMANDS[command.opcode](self)
+
+
+    def apply(self, commands, trusted: bool = False, snapshots_at: list[int] = None,
+              final_state: bool = False) -> tuple | list[tuple] | None:
+        '''Performs every command from an iterable of text commands and Command tuples, as process_command()
+        and execute() would. If indices are given, returns a list of the snapshots taken right after the
+        commands at those indices; otherwise returns a snapshot taken after the last command if final_state
+        is set, or None.'''
+        parse = parse_command
+        handlers = self._COMMANDS
+        create_faller = self._create_faller
+        wanted = set(snapshots_at) if snapshots_at != None else ()
+        snapshots = []
+
+        for position, command in enumerate(commands):
+            if command.__class__ is str:
+                command = parse(command)
+            opcode, column, jewels = command
+            if opcode == Opcode.FALLER:
+                create_faller(column - 1, jewels, trusted)
+            else:
+                handlers[opcode](self)
+            if position in wanted:
+                snapshots.append(self.snapshot())
+
+        if snapshots_at != None:
+            return snapshots
+        if final_state:
+            return self.snapshot()
+        return None
+
+
+    def _tick(self) -> None:
+        'Removes matching jewels and drops everything once.'
+        self.remove_matching()
+        self.drop_once()
+
+
+    def _quit(self) -> None:
+        'Quits the program.'
+        quit()
 
 
     def create_faller(self, user_input: str) -> None:
         'Creates a new faller and places the bottommost jewel in the field.'
-        if self._faller != None or self._jewels_matched():
+        command = _parse_faller(user_input)
+        self._create_faller(command.column - 1, command.jewels)
+
+
+    def _create_faller(self, col: int, jewels: tuple[int, ...], trusted: bool = False) -> None:
+        'Creates a new faller from a 0-based column and three jewel codes, checking them unless trusted.'
+        if self._faller != None or self._matched:
             return
-        
+
+        if not trusted:
+            if col < 0 or col >= self._columns:
+                raise ColumnDoesNotExist('Column does not exist in the game field!')
+            if len(jewels) != 3 or not all(1 <= jewel <= len(_JEWELS) for jewel in jewels):
+                raise ExpectedInputMismatch('One of the specified jewels does not exist!')
+
         self._faller_frozen = False
         self._faller_landed = False
-        list_input = user_input.split()
-        self._faller_column = int(list_input[1]) - 1
-
-        if self._faller_column < 0 or self._faller_column >= self._columns:
-            raise ColumnDoesNotExist('Column does not exist in the game field!')
-        
-        colors = list_input[2:]
+        self._faller_column = col
         self._bottom_faller_row = 2
+        self._faller = list(jewels)
+        if self._cells[3 * self._columns + col] != _EMPTY:
+            self._game_over = True
+        self.drop_once()
 
-        possible_colors = ['S', 'T', 'V', 'W', 'X', 'Y', 'Z']
 
-        if colors[0] in possible_colors and colors[1] in possible_colors and colors[2] in possible_colors:
-            pass
-        else:
+    def place(self, column: int, rotation: int, colors: list[str] = None) -> PlacementResult:
+        '''Drops a faller with the given colors (top first), rotated the given number of times, straight down
+        the given column and freezes it, then clears matches until none are left. Without colors, the
+        current faller is placed instead.'''
+        if colors == None:
+            if self._faller == None:
+                raise ExpectedInputMismatch('There is no faller to place!')
+            jewels = self._faller
+        elif self._faller != None:
+            raise ExpectedInputMismatch('A faller is already in the game field!')
+        elif len(colors) != 3 or any(color not in _JEWEL_CODES for color in colors):
             raise ExpectedInputMismatch('One of the specified jewels does not exist!')
+        else:
+            jewels = [_JEWEL_CODES[color] for color in colors]
+        if column < 1 or column > self._columns:
+            raise ColumnDoesNotExist('Column does not exist in the game field!')
+        if self._game_over:
+            return PlacementResult([], True)
 
-        self._faller = [colors[0], colors[1], colors[2]]
-        self._field[0][self._faller_column] = f'[{self._faller[0]}]'
-        self._field[1][self._faller_column] = f'[{self._faller[1]}]'
-        self._field[2][self._faller_column] = f'[{self._faller[2]}]'
-        if self._field[3][self._faller_column] != '   ':
+        self._faller = None
+        self.resolve()
+        if self._unsettled:
+            self.drop_jewels()
+
+        col = column - 1
+        if self._tops[col] <= 3:
             self._game_over = True
-        self.drop_once()
+            return PlacementResult([], True)
+
+        faller = list(jewels)
+        for _ in range(rotation % 3):
+            faller = [faller[2], faller[0], faller[1]]
+        self._faller = faller
+        self._faller_column = col
+        self._bottom_faller_row = self._tops[col] - 1
+        self._faller_landed = True
+        self._freeze_faller()
+
+        chains = [len(cleared) for cleared in self.resolve()]
+        self.check_game_over()
+        return PlacementResult(chains, self._game_over)
+
+
+    def resolve(self) -> list[list[tuple[int, int]]]:
+        '''Clears matching jewels and lets the rest fall until nothing matches, and returns the row and column
+        (as in field()) of the jewels cleared in each step of the chain.'''
+        chains = []
+        while True:
+            self._mark_matching(_ALL_DIRECTIONS)
+            if not self._matched:
+                return chains
+            chains.append([divmod(index, self._columns) for index in self._matched])
+            self.remove_matching()
 
 
     def create_random_faller(self):
         if self._faller != None or self._jewels_matched():
             return
-        
-        column_available = False
-        for col in range(self._columns):
-            if self.game_field()[0][col] == '   ':
-                column_available = True
 
-        if not column_available:
-            self.create_faller('F 1 S T V')
+        if not self._free_columns:
+            self._create_faller(0, _FULL_FIELD_FALLER, True)
             return
 
-        column = random.randint(1, self._columns)
-        while self.game_field()[0][column - 1] != '   ':
-            column = random.randint(1, self._columns)
+        if self._next_faller == _FALLERS_PER_BLOCK:
+            self._generate_fallers()
+        jewels, column_picks = self._upcoming_fallers
+        faller = self._next_faller
+        self._next_faller += 1
+
+        column = self._free_columns[int(column_picks[faller] * len(self._free_columns))]
+        self._create_faller(column, jewels[3 * faller:3 * faller + 3], True)
 
-        column = str(column)
-        jewel_colors = ['S', 'T', 'V', 'W', 'X', 'Y', 'Z']
-        first_jewel = random.choice(jewel_colors)
-        second_jewel = random.choice(jewel_colors)
-        third_jewel = random.choice(jewel_colors)
 
-        self.create_faller(f'F {column} {first_jewel} {second_jewel} {third_jewel}')
+    def _generate_fallers(self) -> None:
+        'Draws the jewels and columns of the next block of random fallers.'
+        jewels = self._random.choices(_JEWEL_CODE_LIST, k=3 * _FALLERS_PER_BLOCK)
+        column_picks = [self._random.random() for _ in range(_FALLERS_PER_BLOCK)]
+        self._upcoming_fallers = (jewels, column_picks)
+        self._next_faller = 0
+        self._random_state = self._random.getstate()
+
 
-    
     def _jewels_matched(self) -> bool:
         'Returns True if there are any jewels marked as matched by asterisks. Returns False otherwise.'
-        for row in range(self._rows + 3):
-            for col in range(self._columns):
-                if self._field[row][col].startswith('*'):
-                    return True
-        return False
-        
+        return len(self._matched) > 0
+
+
+    def _write(self, index: int, cell: int) -> None:
+        'Changes the cell at the given index of the field.'
+        old_cell = self._cells[index]
+        if self._undo_log != None:
+            self._undo_log.append((index, old_cell))
+        if self._changes != None and index not in self._changes:
+            self._changes[index] = old_cell
+        self._hash ^= _zobrist_key(index, old_cell) ^ _zobrist_key(index, cell)
+        self._cells[index] = cell
+
+
+    def _touch(self, row: int, col: int) -> None:
+        'Records that the cell at the given position changed so the next match checks examine it.'
+        if row < self._touched_top:
+            self._touched_top = row
+        if row > self._touched_bottom:
+            self._touched_bottom = row
+        if col < self._touched_left:
+            self._touched_left = col
+        if col > self._touched_right:
+            self._touched_right = col
+        self._unchecked = _ALL_CHECKS
+
+
+    def _reset_touched(self) -> None:
+        'Forgets all changed cells once every match direction has examined them.'
+        self._touched_top = self._rows + 3
+        self._touched_bottom = -1
+        self._touched_left = self._columns
+        self._touched_right = -1
+        self._unchecked = 0
+
 
     def drop_once(self) -> None:
         'Drops all jewels on the field once if possible.'
+        columns = self._columns
         jewels_dropped = False
-        for row in range(self._rows + 1, -1, -1):
-            for col in range(self._columns):
-                if self._field[row + 1][col] == '   ' and self._field[row][col] != '   ':
-                    self._field[row + 1][col] = self._field[row][col]
-                    self._field[row][col] = '   '
-                    jewels_dropped = True
-        if jewels_dropped and self._faller != None:
-            self._bottom_faller_row += 1
-            if self._bottom_faller_row + 1 >= self._rows + 3 or self._field[self._bottom_faller_row + 1][self._faller_column] != '   ':
-                self._faller_landed = True
-                for row in range (self._rows + 3):
-                    for col in range(self._columns):
-                        if self._field[row][col].startswith('['):
-                            self._field[row][col] = f'|{self._field[row][col][1]}|'
-        if not jewels_dropped and self._faller_landed:
-            self._faller_frozen = True
-            self._faller = None
-            for row in range (self._rows + 3):
-                for col in range(self._columns):
-                    if self._field[row][col].startswith('|'):
-                        self._field[row][col] = f' {self._field[row][col][1]} '
+
+        # Only columns with gaps below some jewels have anything to drop
+        # besides the faller.
+        for col in list(self._unsettled):
+            if self._drop_column_once(col):
+                jewels_dropped = True
+            else:
+                self._unsettled.discard(col)
+
+        if self._faller != None:
+            col = self._faller_column
+            below = self._bottom_faller_row + 1
+            if below < self._rows + 3 and self._cells[below * columns + col] == _EMPTY:
+                self._bottom_faller_row = below
+                jewels_dropped = True
+                if below + 1 >= self._rows + 3 or self._cells[(below + 1) * columns + col] != _EMPTY:
+                    self._faller_landed = True
         if not jewels_dropped and self._faller != None:
-            self._faller_landed = True
-            for row in range (self._rows + 3):
-                for col in range(self._columns):
-                    if self._field[row][col].startswith('['):
-                        self._field[row][col] = f'|{self._field[row][col][1]}|'
+            if self._faller_landed:
+                self._freeze_faller()
+            else:
+                self._faller_landed = True
 
         return jewels_dropped
-        
+
+
+    def _drop_column_once(self, col: int) -> bool:
+        'Drops every jewel of a column that has an empty cell below it by one row.'
+        columns = self._columns
+        top = self._tops[col]
+        start = top * columns + col
+        column = self._cells[start::columns]
+        gap = column.rfind(_EMPTY)
+        if gap == -1:
+            return False
+
+        # Every jewel above the lowest empty cell has a gap below it and moves
+        # down one row, so only the cells from the top of the column down to
+        # that empty cell change.
+        for row in range(gap, 0, -1):
+            if column[row] != column[row - 1]:
+                self._write(start + row * columns, column[row - 1])
+        self._write(start, _EMPTY)
+        self._set_top(col, top + 1)
+        self._touch(top + 1, col)
+        self._touch(top + gap, col)
+        return True
+
+
+    def _freeze_faller(self) -> None:
+        'Writes the jewels of the landed faller into the field.'
+        col = self._faller_column
+        top_row = self._bottom_faller_row - 2
+        for row, jewel in enumerate(self._faller, start=top_row):
+            self._write(row * self._columns + col, jewel)
+            self._touch(row, col)
+        self._set_top(col, min(self._tops[col], top_row))
+        self._faller_frozen = True
+        self._faller = None
+
 
     def rotate_faller(self) -> None:
         'Rotates the current faller in the game field.'
         if self._faller == None:
             return
-        
+
         self._faller = [self._faller[2], self._faller[0], self._faller[1]]
-        temp_first = self._field[self._bottom_faller_row][self._faller_column] 
-        self._field[self._bottom_faller_row][self._faller_column] = self._field[self._bottom_faller_row - 1][self._faller_column]
-        self._field[self._bottom_faller_row - 1][self._faller_column] = self._field[self._bottom_faller_row - 2][self._faller_column]
-        self._field[self._bottom_faller_row - 2][self._faller_column] = temp_first
 
 
     def move_faller_left(self) -> None:
         'Moves the current faller in the game field to the left if possible.'
         if self._faller == None:
             return
-        
+
         if (self._faller_column - 1) < 0:
             return
-        
-        space_availabe = True
-        for row in range(self._rows + 2, -1, -1):
-            if (self._field[row][self._faller_column].startswith('[') or self._field[row][self._faller_column].startswith('|')) and \
-                self._field[row][self._faller_column - 1] != '   ':
-                space_availabe = False
-
-        if space_availabe:
-            self._faller_column = self._faller_column - 1
-            for row in range(self._rows + 2, -1, -1):
-                if self._field[row][self._faller_column + 1].startswith('[') or self._field[row][self._faller_column + 1].startswith('|'):
-                    self._field[row][self._faller_column] = self._field[row][self._faller_column + 1]
-                    self._field[row][self._faller_column + 1] = '   '
-
-            space_in_column = False
-            index_row = self._find_top_jewel(self._faller_column)
-            for row in range(index_row, self._rows + 3):
-                if self._field[row][self._faller_column] == '   ':
-                    space_in_column = True
-            if space_in_column:
-                self._faller_landed = False
-                for row in range(self._rows + 3):
-                    if self._field[row][self._faller_column].startswith('|'):
-                        self._field[row][self._faller_column] = f'[{self._field[row][self._faller_column][1]}]'
-            else:
-                self._faller_landed = True
-                for row in range(self._rows + 3):
-                    if self._field[row][self._faller_column].startswith('['):
-                        self._field[row][self._faller_column] = f'|{self._field[row][self._faller_column][1]}|'
+
+        self._shift_faller(-1)
 
 
-    def _find_top_jewel(self, column: int) -> int:
-        'Returns the row number of the first occurence of a jewel in the given column.'
-        for row in range(self._rows + 3):
-            if self._field[row][column] != '   ':
-                return row
+    def _shift_faller(self, offset: int) -> None:
+        'Moves the faller sideways by the given offset if the neighboring cells are empty.'
+        cells = self._cells
+        columns = self._columns
+        bottom = self._bottom_faller_row * columns + self._faller_column + offset
+        if cells[bottom] != _EMPTY or cells[bottom - columns] != _EMPTY or cells[bottom - 2 * columns] != _EMPTY:
+            return
+
+        self._faller_column = self._faller_column + offset
+        if self._faller_column in self._unsettled:
+            space_in_column = _EMPTY in cells[bottom + columns::columns]
+        else:
+            space_in_column = self._tops[self._faller_column] > self._bottom_faller_row + 1
+        self._faller_landed = not space_in_column
 
 
     def move_faller_right(self) -> None:
         'Moves the current faller in the game field to the right if possible.'
         if self._faller == None:
             return
-        
+
         if (self._faller_column + 1) >= self._columns:
             return
-        
-        space_availabe = True
-        for row in range(self._rows + 2, -1, -1):
-            if (self._field[row][self._faller_column].startswith('[') or self._field[row][self._faller_column].startswith('|')) and \
-                self._field[row][self._faller_column + 1] != '   ':
-                space_availabe = False
-
-        if space_availabe:
-            self._faller_column = self._faller_column + 1
-            for row in range(self._rows + 2, -1, -1):
-                if self._field[row][self._faller_column - 1].startswith('[') or self._field[row][self._faller_column - 1].startswith('|'):
-                    self._field[row][self._faller_column] = self._field[row][self._faller_column - 1]
-                    self._field[row][self._faller_column - 1] = '   '
-
-            space_in_column = False
-            index_row = self._find_top_jewel(self._faller_column)
-            for row in range(index_row, self._rows + 3):
-                if self._field[row][self._faller_column] == '   ':
-                    space_in_column = True
-            if space_in_column:
-                self._faller_landed = False
-                for row in range(self._rows + 3):
-                    if self._field[row][self._faller_column].startswith('|'):
-                        self._field[row][self._faller_column] = f'[{self._field[row][self._faller_column][1]}]'
-            else:
-                self._faller_landed = True
-                for row in range(self._rows + 3):
-                    if self._field[row][self._faller_column].startswith('['):
-                        self._field[row][self._faller_column] = f'|{self._field[row][self._faller_column][1]}|'
+
+        self._shift_faller(1)
 
 
     def check_game_over(self) -> None:
         'Ends the game if the faller is frozen and not all of it can fit on the field.'
         if self._faller_frozen:
-            for row in self._field:
-                for jewel in row:
-                    if jewel.startswith('*'):
-                        return
-            for row in range(3):
-                for col in range(self._columns):
-                    if self._field[row][col] != '   ':
-                        self._game_over = True
+            if self._jewels_matched():
+                return
+            if self._overflowing:
+                self._game_over = True
 
 
     def remove_matching(self) -> None:
         'Removes all jewels that have been identified as matching with other jewels.'
-        matches_removed = False
-        for row in range(self._rows + 3):
-            for col in range(self._columns):
-                if self._field[row][col].startswith('*'):
-                    self._field[row][col] = '   '
-                    matches_removed = True
-        if matches_removed:
-            self.drop_jewels()
+        if not self._matched:
+            return
+
+        for index in self._matched:
+            self._write(index, _EMPTY)
+            self._unsettled.add(index % self._columns)
+        self._matched = []
+        self.drop_jewels()
+
+
+    def _mark_matching(self, directions: tuple[int, ...]) -> None:
+        'Marks every jewel that is part of three or more matching jewels in any of the given directions.'
+        if not self._faller_frozen:
+            return
+
+        directions = tuple(direction for direction in directions if self._unchecked >> direction & 1)
+        if not directions:
+            return
+
+        # Any new line of three passes through a changed cell, so only the
+        # cells within two rows and columns of the changed ones are examined.
+        columns = self._columns
+        first_row = max(self._touched_top - 2, 0)
+        last_row = min(self._touched_bottom + 2, self._rows + 2)
+        first_col = max(self._touched_left - 2, 0)
+        width = min(self._touched_right + 2, columns - 1) - first_col + 1
+        if width == columns:
+            window = self._cells[first_row * columns:(last_row + 1) * columns]
+        else:
+            window = b''.join(self._cells[start:start + width]
+                              for start in range(first_row * columns + first_col, (last_row + 1) * columns, columns))
+
+        matched = _matching_cells(window, width, directions)
+        if matched:
+            marks = matched.to_bytes(len(window), 'little')
+            position = marks.find(1)
+            while position != -1:
+                row, col = divmod(position, width)
+                index = (first_row + row) * columns + first_col + col
+                if not self._cells[index] & _MATCHED:
+                    self._write(index, self._cells[index] | _MATCHED)
+                    self._matched.append(index)
+                position = marks.find(1, position + 1)
+
+        for direction in directions:
+            self._unchecked &= ~(1 << direction)
+        if not self._unchecked:
+            self._reset_touched()
 
 
     def check_horizontal_match(self) -> None:
         'Checks if there are three or more jewels matching horizontally and marks them.'
-        if self._faller_frozen:
-            for row in range(self._rows + 3):
-                for col in range(self._columns - 2):
-                    if self._field[row][col][1] == self._field[row][col + 1][1] == self._field[row][col + 2][1] and self._field[row][col] != '   ':
-                        self._field[row][col] = f'*{self._field[row][col][1]}*'
-                        self._field[row][col + 1] = f'*{self._field[row][col][1]}*'
-                        self._field[row][col + 2] = f'*{self._field[row][col][1]}*'
+        self._mark_matching((_HORIZONTAL,))
 
 
     def check_vertical_match(self) -> None:
         'Checks if there are three or more jewels matching vertically and marks them.'
-        if self._faller_frozen:
-            field_copy = self.field()
-            for col in range(self._columns):
-                for row in range(self._rows + 1):
-                    if field_copy[row][col][1] == field_copy[row + 1][col][1] == field_copy[row + 2][col][1] and field_copy[row][col] != '   ':
-                        self._field[row][col] = f'*{field_copy[row][col][1]}*'
-                        self._field[row + 1][col] = f'*{field_copy[row][col][1]}*'
-                        self._field[row + 2][col] = f'*{field_copy[row][col][1]}*'
-    
+        self._mark_matching((_VERTICAL,))
+
 
     def check_diagonal_match(self) -> None:
         'Checks if there are three or more jewels matching diagonally and marks them.'
-        self._diagonal_right_down()
-        self._diagonal_left_down()
+        self._mark_matching((_RIGHT_DOWN, _LEFT_DOWN))
 
 
     def _diagonal_right_down(self) -> None:
         'Checks if there are three or more jewels matching diagonally to the right downwards.'
-        if self._faller_frozen:
-            field_copy = self.field()
-            for row in range(self._rows + 1):
-                for col in range(self._columns - 2):
-                    if self._field[row][col][1] == field_copy[row + 1][col + 1][1] == field_copy[row + 2][col + 2][1] and field_copy[row][col] != '   ':
-                        self._field[row][col] = f'*{field_copy[row][col][1]}*'
-                        self._field[row + 1][col + 1] = f'*{field_copy[row + 1][col + 1][1]}*'
-                        self._field[row + 2][col + 2] = f'*{field_copy[row + 2][col + 2][1]}*'
-
-    
+        self._mark_matching((_RIGHT_DOWN,))
+
+
     def _diagonal_left_down(self) -> None:
         'Checks if there are three or more jewels matching diagonally to the left downwards.'
-        if self._faller_frozen:
-            field_copy = self.field()
-            for row in range(self._rows + 1):
-                for col in range(2, self._columns):
-                    if self._field[row][col][1] == field_copy[row + 1][col - 1][1] == field_copy[row + 2][col - 2][1] and field_copy[row][col] != '   ':
-                        self._field[row][col] = f'*{field_copy[row][col][1]}*'
-                        self._field[row + 1][col - 1] = f'*{field_copy[row + 1][col - 1][1]}*'
-                        self._field[row + 2][col - 2] = f'*{field_copy[row + 2][col - 2][1]}*'
+        self._mark_matching((_LEFT_DOWN,))
+
+
+    def snapshot(self) -> tuple:
+        'Returns a copy of the state of the game that can later be given to restore().'
+        return bytes(self._cells), self._state()
+
+
+    def restore(self, snapshot: tuple) -> None:
+        'Returns the game to the state saved by snapshot(), discarding any undo points.'
+        cells, state = snapshot
+        if self._changes != None:
+            old_cells = bytes(self._cells)
+            difference = int.from_bytes(old_cells, 'little') ^ int.from_bytes(cells, 'little')
+            for index in _nonzero_indices(difference.to_bytes(len(cells), 'little')):
+                self._changes.setdefault(index, old_cells[index])
+        self._cells[:] = cells
+        self._set_state(state)
+        self._undo_points = []
+        self._undo_log = None
+
+
+    def clone(self) -> 'ColumnsGame':
+        'Returns an independent copy of the game, without any undo points.'
+        game = copy.copy(self)
+        game._cells = bytearray(self._cells)
+        game._random = random.Random()
+        game._random.setstate(self._random.getstate())
+        game._set_state(self._state())
+        game._undo_points = []
+        game._undo_log = None
+        game._changes = None
+        game._faller_cells = {}
+        return game
+
+
+    def push_undo(self) -> None:
+        'Sets an undo point at the current state. Until it is undone, only the cells that change are recorded.'
+        if self._undo_log == None:
+            self._undo_log = []
+        self._undo_points.append((len(self._undo_log), self._state()))
+
+
+    def undo(self) -> None:
+        'Returns the game to the state it was in at the most recent undo point, and removes that point.'
+        position, state = self._undo_points.pop()
+        log = self._undo_log
+        changes = self._changes
+        while len(log) > position:
+            index, cell = log.pop()
+            if changes != None:
+                changes.setdefault(index, self._cells[index])
+            self._cells[index] = cell
+        self._set_state(state)
+        if not self._undo_points:
+            self._undo_log = None
+
+
+    def _state(self) -> tuple:
+        'Returns a copy of everything about the game except the cells of the field.'
+        return (self._faller and self._faller.copy(), self._bottom_faller_row, self._faller_column,
+                self._faller_landed, self._faller_frozen, self._game_over,
+                self._tops.copy(), self._overflowing, self._unsettled.copy(), self._matched.copy(),
+                self._free_columns.copy(), self._free_positions.copy(),
+                self._upcoming_fallers, self._next_faller, self._random_state,
+                self._touched_top, self._touched_bottom, self._touched_left, self._touched_right, self._unchecked,
+                self._hash)
+
+
+    def _set_state(self, state: tuple) -> None:
+        'Puts back a copy of the state returned by _state().'
+        (faller, self._bottom_faller_row, self._faller_column,
+         self._faller_landed, self._faller_frozen, self._game_over,
+         tops, self._overflowing, unsettled, matched, free_columns, free_positions,
+         self._upcoming_fallers, self._next_faller, random_state,
+         self._touched_top, self._touched_bottom, self._touched_left, self._touched_right, self._unchecked,
+         self._hash) = state
+        self._faller = faller and faller.copy()
+        self._tops = tops.copy()
+        self._unsettled = unsettled.copy()
+        self._matched = matched.copy()
+        self._free_columns = free_columns.copy()
+        self._free_positions = free_positions.copy()
+        if random_state is not self._random_state:
+            self._random.setstate(random_state)
+            self._random_state = random_state
+
+
+    def zobrist_hash(self) -> int:
+        'Returns a 64-bit Zobrist hash of the field with the faller, its position and whether it has landed.'
+        state_hash = self._hash
+        if self._faller != None:
+            state = _FALLER | _LANDED if self._faller_landed else _FALLER
+            index = (self._bottom_faller_row - 2) * self._columns + self._faller_column
+            for jewel in self._faller:
+                state_hash ^= _zobrist_key(index, jewel | state)
+                index += self._columns
+        return state_hash
 
 
     def game_over(self) -> bool:
         'Returns the a boolean representing whether the game is over or not.'
         return self._game_over
-    
+
 
     def rows(self) -> int:
         'Returns the number of rows in the field.'
         return self._rows
-    
-    
+
+
     def columns(self) -> int:
         'Returns the number of columsn in the field.'
         return self._columns
-    
-    
+
+
     def field(self) -> list[list]:
         'Returns the 2D list reprenting the field including fallers outside the game field.'
-        return self._field.copy()
-    
-    
+        return self._field_rows(0)
+
+
     def game_field(self) -> list[list]:
         'Return the 2D list representing the game field without any fallers that are outside the game field.'
-        field_copy = self._field.copy()
-        field_copy = field_copy[3:]
-        return field_copy
-    
+        return self._field_rows(3)
+
+
+    def _field_rows(self, first_row: int) -> list[list]:
+        'Builds the string view of the field starting at the given row, with the faller merged in.'
+        columns = self._columns
+        to_string = _CELL_STRINGS.__getitem__
+        field = [list(map(to_string, self._cells[start:start + columns]))
+                 for start in range(first_row * columns, len(self._cells), columns)]
+
+        if self._faller != None:
+            state = _FALLER | _LANDED if self._faller_landed else _FALLER
+            for row, jewel in enumerate(self._faller, start=self._bottom_faller_row - 2 - first_row):
+                if row >= 0:
+                    field[row][self._faller_column] = _CELL_STRINGS[jewel | state]
+        return field
+
+
+    def consume_changes(self) -> list[CellChange]:
+        '''Returns every cell of field() whose state changed since the last call, in row order, with the faller
+        merged in as in field(). The first call returns every cell that is not empty.'''
+        faller_cells = self._faller_view()
+        if self._changes == None:
+            changes = dict.fromkeys(_nonzero_indices(self._cells), _EMPTY)
+            old_faller_cells = {}
+        else:
+            changes = self._changes
+            old_faller_cells = self._faller_cells
+        self._changes = {}
+        self._faller_cells = faller_cells
+
+        cells = self._cells
+        columns = self._columns
+        result = []
+        for index in sorted(changes.keys() | old_faller_cells.keys() | faller_cells.keys()):
+            old = old_faller_cells[index] if index in old_faller_cells else changes.get(index, cells[index])
+            new = faller_cells.get(index, cells[index])
+            if old != new:
+                row, col = divmod(index, columns)
+                result.append(CellChange(row, col, _CELL_STRINGS[old], _CELL_STRINGS[new]))
+        return result
+
+
+    def _faller_view(self) -> dict[int, int]:
+        'Returns the index of each cell the faller is shown on, with the byte it is shown as.'
+        if self._faller == None:
+            return {}
+        state = _FALLER | _LANDED if self._faller_landed else _FALLER
+        top = (self._bottom_faller_row - 2) * self._columns + self._faller_column
+        return {top + offset * self._columns: jewel | state for offset, jewel in enumerate(self._faller)}
+
+
+    def column_heights(self) -> list[int]:
+        'Returns the height of the frozen jewels in each column, counted in rows from the bottom of the field.'
+        return [self._rows + 3 - top for top in self._tops]
+
 
     def get_faller(self) -> list[list]:
         'Returns the current faller in the game field.'
-        return self._faller.copy()
-    
+        return [_JEWELS[jewel - 1] for jewel in self._faller]
+
+
+    def faller_column(self) -> int:
+        'Returns the column number of the current faller, or None if there is no faller.'
+        if self._faller == None:
+            return None
+        return self._faller_column + 1
+
+
+    def matched_count(self) -> int:
+        'Returns the number of jewels currently marked as matched.'
+        return len(self._matched)
+
 
     def faller_landed(self):
-        return self._faller_landed
\ No newline at end of file
+        return self._faller_landed
+
+
+    _COMMANDS = {
+        Opcode.TICK: _tick,
+        Opcode.ROTATE: rotate_faller,
+        Opcode.LEFT: move_faller_left,
+        Opcode.RIGHT: move_faller_right,
+        Opcode.QUIT: _quit,
+    }
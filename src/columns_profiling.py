@@ -0,0 +1,101 @@
+import collections
+import json
+import time
+
+
+_WINDOW = 1000
+_PERCENTILES = (0.5, 0.95)
+
+
+class TickProfiler:
+    def __init__(self, window: int = _WINDOW, tracer=None) -> None:
+        '''Creates a profiler that keeps the most recent timings of every phase, up to window of them. Every
+        timing is also passed on as a span to the tracer, if one is given.'''
+        self._window = window
+        self._tracer = tracer
+        self._samples = {}
+        self._counts = {}
+        self._totals = {}
+
+
+    def time(self, phase: str, function, *args):
+        'Calls the function with the given arguments, records how long it took under the phase, and returns its result.'
+        start = time.perf_counter()
+        result = function(*args)
+        self.stop(phase, start)
+        return result
+
+
+    def start(self) -> float:
+        'Returns the time a phase timed with stop() starts at.'
+        return time.perf_counter()
+
+
+    def stop(self, phase: str, start: float) -> None:
+        'Records the time since the given start() under the phase.'
+        end = time.perf_counter()
+        self.record(phase, end - start)
+        if self._tracer != None:
+            self._tracer.span(phase, start, end)
+
+
+    def record(self, phase: str, seconds: float) -> None:
+        'Records one timing of the given phase.'
+        samples = self._samples.get(phase)
+        if samples == None:
+            samples = self._samples[phase] = collections.deque(maxlen=self._window)
+            self._counts[phase] = 0
+            self._totals[phase] = 0.0
+        samples.append(seconds)
+        self._counts[phase] += 1
+        self._totals[phase] += seconds
+
+
+    def phases(self) -> list[str]:
+        'Returns the names of the phases timed so far, in the order they were first timed.'
+        return list(self._samples)
+
+
+    def count(self, phase: str) -> int:
+        'Returns how many times the phase has been timed.'
+        return self._counts.get(phase, 0)
+
+
+    def histogram(self, phase: str) -> dict[int, int]:
+        '''Returns how many recent timings of the phase fall in each power of two bucket, keyed by the bucket's
+        lower bound in microseconds (0 for timings under a microsecond).'''
+        buckets = collections.Counter()
+        for seconds in self._samples.get(phase, ()):
+            bits = int(seconds * 1e6).bit_length()
+            buckets[1 << (bits - 1) if bits else 0] += 1
+        return dict(sorted(buckets.items()))
+
+
+    def summary(self) -> dict[str, dict]:
+        'Returns the count and total time of every phase, and the mean, percentiles, maximum and histogram of its recent timings.'
+        summary = {}
+        for phase, samples in self._samples.items():
+            recent = sorted(samples)
+            stats = {'count': self._counts[phase], 'total': self._totals[phase],
+                     'mean': sum(recent) / len(recent)}
+            for fraction in _PERCENTILES:
+                stats[f'p{int(fraction * 100)}'] = recent[min(len(recent) - 1, int(fraction * len(recent)))]
+            stats['max'] = recent[-1]
+            stats['histogram'] = self.histogram(phase)
+            summary[phase] = stats
+        return summary
+
+
+    def summary_lines(self) -> list[str]:
+        'Returns one line of text per phase with its count and recent timings in microseconds.'
+        lines = [f'{"phase":<22} {"count":>7} {"mean":>8} {"p50":>8} {"p95":>8} {"max":>8}']
+        for phase, stats in self.summary().items():
+            lines.append(f'{phase:<22} {stats["count"]:>7} {stats["mean"] * 1e6:>8.0f} {stats["p50"] * 1e6:>8.0f} '
+                         f'{stats["p95"] * 1e6:>8.0f} {stats["max"] * 1e6:>8.0f}')
+        return lines
+
+
+    def dump(self, path: str) -> None:
+        'Writes the summary of every phase to a file as JSON, with times in seconds.'
+        with open(path, 'w') as output:
+            json.dump({'window': self._window, 'phases': self.summary()}, output, indent=1)
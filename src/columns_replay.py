@@ -0,0 +1,91 @@
+import sys
+
+import columns_logic
+
+
+# A line holding only this asks for the field to be written right away.
+_SHOW_FIELD = '?'
+_OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def format_field(game: columns_logic.ColumnsGame) -> str:
+    'Returns the game field as text, one |row| per line followed by a line under the field.'
+    rows = [f'|{"".join(row)}|\n' for row in game.game_field()]
+    rows.append(f' {"-" * 3 * game.columns()} \n')
+    return ''.join(rows)
+
+
+def read_game(lines) -> columns_logic.ColumnsGame:
+    'Creates a game from the header of a command log: rows, columns, then EMPTY or CONTENTS and the rows of jewels.'
+    rows = int(next(lines))
+    columns = int(next(lines))
+    game = columns_logic.ColumnsGame(rows, columns)
+
+    start = next(lines).rstrip('\r\n')
+    if start == 'CONTENTS':
+        for row in range(rows):
+            game.place_contents(row, next(lines).rstrip('\r\n'))
+    elif start != 'EMPTY':
+        raise columns_logic.ExpectedInputMismatch('Expected EMPTY or CONTENTS!')
+    return game
+
+
+def replay(lines, output, every: int = 0, final: bool = True) -> columns_logic.ColumnsGame:
+    'Applies every command from the given lines to a new game, writing the field every N commands, on ? and at the end.'
+    lines = iter(lines)
+    game = read_game(lines)
+    process_command = game.process_command
+
+    commands = 0
+    for line in lines:
+        command = line.rstrip('\r\n')
+        if command == _SHOW_FIELD:
+            output.write(format_field(game))
+            continue
+        if command == 'Q':
+            break
+
+        if command == '':
+            process_command('')
+            game.check_horizontal_match()
+            game.check_vertical_match()
+            game.check_diagonal_match()
+            game.check_game_over()
+        else:
+            process_command(command)
+
+        commands += 1
+        if game.game_over():
+            break
+        if every and commands % every == 0:
+            output.write(format_field(game))
+
+    if final or game.game_over():
+        output.write(format_field(game))
+    if game.game_over():
+        output.write('GAME OVER\n')
+    return game
+
+
+def add_parser(subparsers) -> None:
+    'Adds the replay command to the given argparse subparsers.'
+    parser = subparsers.add_parser('replay', help='apply a log of text commands to a game')
+    parser.add_argument('input', nargs='?', default='-', help='command log, or - for standard input')
+    parser.add_argument('--output', default='-', help='file to write fields to, or - for standard output')
+    parser.add_argument('--every', type=int, default=0, help='write the field after every N commands')
+    parser.add_argument('--no-final', dest='final', action='store_false',
+                        help='do not write the field after the last command')
+    parser.set_defaults(run=run)
+
+
+def run(args) -> None:
+    'Runs the replay command with parsed command line arguments.'
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = open(sys.stdout.fileno(), 'w', buffering=_OUTPUT_BUFFER_SIZE, closefd=False) \
+        if args.output == '-' else open(args.output, 'w', buffering=_OUTPUT_BUFFER_SIZE)
+    try:
+        replay(source, output, args.every, args.final)
+    finally:
+        output.close()
+        if source is not sys.stdin:
+            source.close()
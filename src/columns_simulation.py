@@ -0,0 +1,248 @@
+import argparse
+import concurrent.futures
+import csv
+import importlib
+import json
+import os
+import random
+import sys
+
+import columns_logic
+
+
+_RESULT_FIELDS = ['game', 'seed', 'ticks', 'fallers', 'chains', 'longest_chain', 'cleared', 'cause']
+_GAMES_PER_BLOCK = 16
+
+_TICK = columns_logic.Command(columns_logic.Opcode.TICK)
+_ROTATE = columns_logic.Command(columns_logic.Opcode.ROTATE)
+_LEFT = columns_logic.Command(columns_logic.Opcode.LEFT)
+_RIGHT = columns_logic.Command(columns_logic.Opcode.RIGHT)
+
+
+def random_policy(game: columns_logic.ColumnsGame, faller: list[str], rng: random.Random) -> tuple[int, int]:
+    'Sends every faller to a random column with a random rotation.'
+    return rng.randint(1, game.columns()), rng.randrange(3)
+
+
+def greedy_policy(game: columns_logic.ColumnsGame, faller: list[str], rng: random.Random) -> tuple[int, int]:
+    'Tries every column and rotation, and picks the one that clears the most jewels and keeps the stacks lowest.'
+    best_score = None
+    best_moves = []
+    for column in range(1, game.columns() + 1):
+        for rotation in range(3):
+            game.push_undo()
+            result = game.place(column, rotation)
+            score = (not result.game_over, sum(result.chains), -max(game.column_heights()))
+            game.undo()
+            if best_score == None or score > best_score:
+                best_score = score
+                best_moves = [(column, rotation)]
+            elif score == best_score:
+                best_moves.append((column, rotation))
+    return rng.choice(best_moves)
+
+
+class ScriptedPolicy:
+    def __init__(self, moves: list[tuple[int, int]]) -> None:
+        'Creates a policy that plays the given column and rotation moves in order, starting over when they run out.'
+        if not moves:
+            raise ValueError('A scripted policy needs at least one move!')
+        self._moves = moves
+        self._next_move = 0
+
+
+    def __call__(self, game: columns_logic.ColumnsGame, faller: list[str], rng: random.Random) -> tuple[int, int]:
+        'Returns the next move of the script.'
+        move = self._moves[self._next_move % len(self._moves)]
+        self._next_move += 1
+        return move
+
+
+_POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def read_script(path: str) -> list[tuple[int, int]]:
+    'Reads a script of moves, one "column rotation" pair per line.'
+    moves = []
+    with open(path) as script:
+        for line in script:
+            if line.strip():
+                column, rotation = line.split()
+                moves.append((int(column), int(rotation)))
+    return moves
+
+
+def load_policy(name: str, script: list[tuple[int, int]] = None):
+    'Returns the policy with the given name, "scripted", or a "module:function" to import.'
+    if name == 'scripted':
+        return ScriptedPolicy(script or [])
+    if name in _POLICIES:
+        return _POLICIES[name]
+    if ':' in name:
+        module_name, function_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError(f'Unknown policy {name!r}!')
+
+
+def play_game(rows: int, columns: int, policy, seed: str, max_ticks: int) -> dict:
+    'Plays one game headlessly tick by tick, as the GUI would, and returns its results.'
+    game = columns_logic.ColumnsGame(rows, columns, seed)
+    rng = random.Random(f'{seed}:policy')
+
+    ticks = 0
+    fallers = 0
+    chains = 0
+    chain_length = 0
+    longest_chain = 0
+    cleared = 0
+    cause = 'max_ticks'
+
+    while ticks < max_ticks:
+        ticks += 1
+        game.execute(_TICK, True)
+        game.check_horizontal_match()
+        game.check_vertical_match()
+        game.check_diagonal_match()
+
+        matched = game.matched_count()
+        if matched:
+            chain_length += 1
+            cleared += matched
+        elif chain_length:
+            chains += 1
+            longest_chain = max(longest_chain, chain_length)
+            chain_length = 0
+
+        game.check_game_over()
+        if game.game_over():
+            cause = 'overflow'
+            break
+
+        had_faller = game.faller_column() != None
+        game.create_random_faller()
+        if game.game_over():
+            cause = 'spawn_blocked'
+            break
+        if not had_faller and game.faller_column() != None:
+            fallers += 1
+            _move_faller(game, *policy(game, game.get_faller(), rng))
+
+    return {'seed': seed, 'ticks': ticks, 'fallers': fallers, 'chains': chains,
+            'longest_chain': longest_chain, 'cleared': cleared, 'cause': cause}
+
+
+def _move_faller(game: columns_logic.ColumnsGame, column: int, rotation: int) -> None:
+    'Rotates the new faller and moves it toward the given column until it gets there or is blocked.'
+    for _ in range(rotation % 3):
+        game.execute(_ROTATE, True)
+    command = _LEFT if column < game.faller_column() else _RIGHT
+    while game.faller_column() != column:
+        last_column = game.faller_column()
+        game.execute(command, True)
+        if game.faller_column() == last_column:
+            break
+
+
+def _play_games(first_game: int, count: int, options: dict) -> list[dict]:
+    'Plays a block of games in a worker process and returns their results.'
+    results = []
+    for game_number in range(first_game, first_game + count):
+        policy = load_policy(options['policy'], options['script'])
+        seed = f'{options["seed"]}-{game_number}'
+        result = play_game(options['rows'], options['columns'], policy, seed, options['max_ticks'])
+        result['game'] = game_number
+        results.append(result)
+    return results
+
+
+class _ResultWriter:
+    def __init__(self, output, result_format: str) -> None:
+        'Creates a writer that streams results to the given file as JSON lines or CSV.'
+        self._output = output
+        self._csv = None
+        if result_format == 'csv':
+            self._csv = csv.DictWriter(output, _RESULT_FIELDS)
+            self._csv.writeheader()
+
+
+    def write(self, results: list[dict]) -> None:
+        'Writes a block of results and flushes them.'
+        if self._csv != None:
+            self._csv.writerows(results)
+        else:
+            self._output.writelines(json.dumps({field: result[field] for field in _RESULT_FIELDS}) + '\n'
+                                    for result in results)
+        self._output.flush()
+
+
+def simulate(games: int, options: dict, output, result_format: str = 'jsonl', workers: int = None) -> None:
+    'Plays the given number of games across a pool of worker processes, streaming results as they finish.'
+    writer = _ResultWriter(output, result_format)
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, min(_GAMES_PER_BLOCK, games // (workers * 4) or 1))
+    blocks = ((first, min(chunk, games - first)) for first in range(0, games, chunk))
+
+    # Only a few blocks per worker are queued at a time, so that millions of
+    # games do not turn into millions of pending futures.
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for first, count in blocks:
+            pending.add(executor.submit(_play_games, first, count, options))
+            if len(pending) >= workers * 2:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    writer.write(future.result())
+        for future in concurrent.futures.as_completed(pending):
+            writer.write(future.result())
+
+
+def _policy_name(name: str) -> str:
+    'Checks a --policy name for argparse: random, greedy, scripted, or a module:function that can be imported.'
+    if name == 'scripted' or name in _POLICIES:
+        return name
+    if ':' not in name:
+        raise argparse.ArgumentTypeError(f'unknown policy {name!r}')
+    try:
+        load_policy(name)
+    except (ImportError, AttributeError) as error:
+        raise argparse.ArgumentTypeError(f'cannot load policy {name!r}: {error}')
+    return name
+
+
+def add_parser(subparsers) -> None:
+    'Adds the simulate command to the given argparse subparsers.'
+    parser = subparsers.add_parser('simulate', help='play many games headlessly with a policy')
+    parser.add_argument('--games', type=int, default=1000, help='number of games to play')
+    parser.add_argument('--rows', type=int, default=13)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--policy', type=_policy_name, default='random',
+                        help='random, greedy, scripted, or module:function taking (game, faller, rng)')
+    parser.add_argument('--script', help='file of "column rotation" moves for the scripted policy')
+    parser.add_argument('--seed', default='0', help='base seed; game N is seeded with "SEED-N"')
+    parser.add_argument('--max-ticks', type=int, default=100000, help='ticks before a game is stopped')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', default='-', help='results file, or - for standard output')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='results format (default: from the file name)')
+    parser.set_defaults(run=run, error=parser.error)
+
+
+def run(args) -> None:
+    'Runs the simulate command with parsed command line arguments.'
+    options = {'rows': args.rows, 'columns': args.columns, 'policy': args.policy,
+               'script': read_script(args.script) if args.script else None,
+               'seed': args.seed, 'max_ticks': args.max_ticks}
+    if args.policy == 'scripted' and not args.script:
+        args.error('the scripted policy needs --script')
+    if args.policy == 'scripted' and not options['script']:
+        args.error(f'the script {args.script} has no moves')
+    load_policy(args.policy, options['script'])
+    result_format = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+
+    if args.output == '-':
+        simulate(args.games, options, sys.stdout, result_format, args.workers)
+    else:
+        with open(args.output, 'w', newline='') as output:
+            simulate(args.games, options, output, result_format, args.workers)
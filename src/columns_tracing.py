@@ -0,0 +1,67 @@
+import json
+import os
+import queue
+import threading
+import time
+
+
+_BATCH_SIZE = 1024
+_CATEGORY = 'columns'
+
+
+class TraceWriter:
+    def __init__(self, path: str, batch_size: int = _BATCH_SIZE) -> None:
+        '''Creates a writer of Chrome trace event JSON to the given file, which can be opened in Perfetto or
+        chrome://tracing. Spans are kept in memory and written in batches by a background thread.'''
+        self._file = open(path, 'w')
+        self._batch_size = batch_size
+        self._events = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._tid = threading.get_ident()
+
+        self._file.write('[\n')
+        self._file.write(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': self._tid,
+                                     'args': {'name': threading.current_thread().name}}))
+
+        # Full batches are handed to the writer thread, which does the JSON
+        # formatting and file writes away from the game loop.
+        self._batches = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_batches, name='trace writer', daemon=True)
+        self._thread.start()
+
+
+    def span(self, name: str, start: float, end: float) -> None:
+        'Records a span with the given name between two time.perf_counter() times.'
+        self._events.append((name, start, end))
+        if len(self._events) >= self._batch_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        'Hands the spans recorded so far to the writer thread.'
+        if self._events:
+            self._batches.put(self._events)
+            self._events = []
+
+
+    def close(self) -> None:
+        'Writes every remaining span, waits for the writer thread to finish and closes the file.'
+        self.flush()
+        self._batches.put(None)
+        self._thread.join()
+        self._file.write('\n]\n')
+        self._file.close()
+
+
+    def _write_batches(self) -> None:
+        'Writes batches of spans as trace events until close() is called.'
+        origin = self._origin
+        while True:
+            events = self._batches.get()
+            if events == None:
+                return
+            self._file.write(''.join(
+                ',\n' + json.dumps({'name': name, 'cat': _CATEGORY, 'ph': 'X', 'pid': self._pid, 'tid': self._tid,
+                                    'ts': round((start - origin) * 1e6, 3), 'dur': round((end - start) * 1e6, 3)})
+                for name, start, end in events))
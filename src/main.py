@@ -1,8 +1,20 @@
+import argparse
+import time
+
 import pygame
 import columns_logic
+import columns_profiling
+import columns_tracing
 
 
 _FRAME_RATE = 30
+# Logic ticks per second at each level, starting from level 1. Every tick
+# drops the faller one row, so these set how fast the game plays.
+_TICK_RATES = (1, 1.5, 2, 3, 4, 6, 8, 12, 20, 30, 60)
+# When frames run late, at most this many ticks are run to catch up before a
+# frame is drawn, and at most this many frames in a row go undrawn.
+_MAX_TICKS_PER_FRAME = 8
+_MAX_SKIPPED_FRAMES = 4
 _INITIAL_WIDTH = 450
 _INITIAL_HEIGHT = 850
 _BACKGROUND_COLOR = pygame.Color(0, 0, 0) # Black
@@ -15,17 +27,54 @@ _Y_COLOR = pygame.Color(28, 0, 252) # Dark Blue
 _Z_COLOR = pygame.Color(252, 0, 231) # Pink
 _FALLER_LANDED_COLOR = pygame.Color(75, 75, 75) # Gray
 _MATCHING_COLOR = pygame.Color(255, 255, 255) # White
+_JEWEL_COLORS = {'S': _S_COLOR, 'T': _T_COLOR, 'V': _V_COLOR, 'W': _W_COLOR, 'X': _X_COLOR, 'Y': _Y_COLOR,
+                 'Z': _Z_COLOR}
 _NUM_ROWS = 13
 _NUM_COLUMNS = 6
-_COLUMN_WIDTH = 1 / _NUM_COLUMNS
-_ROW_HEIGHT = 1 / _NUM_ROWS
+_HIDDEN_ROWS = 3
+_EMPTY_CELL = '   '
+_EXPOSE_EVENTS = (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED)
+_PROFILE_KEY = pygame.K_F3
+_LEVEL_UP_KEY = pygame.K_PAGEUP
+_LEVEL_DOWN_KEY = pygame.K_PAGEDOWN
+_CAPTION = 'Columns'
+_PROFILE_TEXT_COLOR = pygame.Color(255, 255, 255) # White
+_PROFILE_FONT_SIZE = 12
 
 
 class ColumnsGUI:
-    def __init__(self):
-        self._game = columns_logic.ColumnsGame(_NUM_ROWS, _NUM_COLUMNS)
+    def __init__(self, rows: int = _NUM_ROWS, columns: int = _NUM_COLUMNS, profile_path: str = None,
+                 trace_path: str = None, level: int = 1, tick_rate: float = None, frame_rate: int = _FRAME_RATE):
+        self._rows = rows
+        self._columns = columns
+        self._game = columns_logic.ColumnsGame(rows, columns)
         self._running = True
 
+        # The game logic ticks at a fixed rate, set by the level unless a tick
+        # rate is given, and frames are drawn at their own rate; 0 draws them
+        # as fast as they can be shown.
+        self._frame_rate = frame_rate
+        self._set_level(level)
+        if tick_rate != None:
+            self._tick_interval = 1 / tick_rate
+        self._lag = 0.0
+        self._skipped_frames = 0
+
+        # The profiler is only made when profiling is asked for, either with
+        # a file to write the timings or a trace to, or with the profile key.
+        # When tracing, the profiler passes every timing on to the tracer.
+        self._profile_path = profile_path
+        self._tracer = columns_tracing.TraceWriter(trace_path) if trace_path != None else None
+        self._profiler = None
+        if profile_path != None or self._tracer != None:
+            self._profiler = columns_profiling.TickProfiler(tracer=self._tracer)
+        self._show_profile = False
+        self._profile_font = None
+
+        # Only the cells that changed are drawn each frame, unless the whole
+        # window needs drawing again, e.g. after it was resized or uncovered.
+        self._full_redraw = True
+
 
     def run(self) -> None:
         'Runs the game from start to finish'
@@ -33,38 +82,122 @@ class ColumnsGUI:
 
         try:
             clock = pygame.time.Clock()
-            frame_cycle = 0
             self._create_surface((_INITIAL_WIDTH, _INITIAL_HEIGHT))
+            self._show_level()
+
+            # The first tick is due at once, so the first faller appears as
+            # soon as the window opens.
+            self._lag = self._tick_interval
+            last_time = time.perf_counter()
 
             while self._running:
+                profiler = self._profiler
+                if profiler == None:
+                    clock.tick(self._frame_rate)
+                else:
+                    frame_start = profiler.start()
+                    profiler.time('clock.tick', clock.tick, self._frame_rate)
+
+                now = time.perf_counter()
+                draw = self._run_ticks(now - last_time)
+                last_time = now
+                if self._game.game_over():
+                    break
+
+                if profiler == None:
+                    self._handle_events()
+                    if draw:
+                        self._update_display(self._draw_frame())
+                else:
+                    profiler.time('_handle_events', self._handle_events)
+                    if draw:
+                        rects = profiler.time('_draw_frame', self._draw_frame)
+                        if self._show_profile:
+                            self._draw_profile()
+                        profiler.time('display.update', self._update_display, rects)
+                    profiler.stop('frame', frame_start)
+
+            self._full_redraw = True
+            while self._game.game_over() and self._running:
                 clock.tick(_FRAME_RATE)
-                if frame_cycle % _FRAME_RATE == 0:
-                    frame_cycle = 0
-                    self._game.process_command('')
-                    self._game.check_horizontal_match()
-                    self._game.check_vertical_match()
-                    self._game.check_diagonal_match()
-                    self._game.check_game_over()
-                    if self._game.game_over():
-                        break
-                    self._game.create_random_faller()
-                    
+                if self._full_redraw:
+                    self._full_redraw = False
+                    self._surface.fill(_BACKGROUND_COLOR)
+                    self._draw_game_over()
                 self._handle_events()
-                self._draw_frame()
-                frame_cycle += 1
 
-            while self._game.game_over() and self._running:
-                self._surface.fill(_BACKGROUND_COLOR)
-                self._draw_game_over()
-                self._handle_events()
-            
         finally:
             pygame.quit()
+            if self._profiler != None and self._profile_path != None:
+                self._profiler.dump(self._profile_path)
+            if self._tracer != None:
+                self._tracer.close()
+
+
+    def _run_ticks(self, elapsed: float) -> bool:
+        '''Runs every logic tick that came due in the given seconds since the last frame, and returns whether
+        this frame should be drawn.'''
+        self._lag += elapsed
+        interval = self._tick_interval
+        ticks = 0
+        while self._lag >= interval and ticks < _MAX_TICKS_PER_FRAME:
+            self._lag -= interval
+            ticks += 1
+            self._tick_game()
+            if self._game.game_over():
+                return True
+
+        # Still behind after as many ticks as a frame allows: skip drawing to
+        # catch up, but only for a few frames, after which the rest of the
+        # backlog is dropped and the game slows down instead.
+        if self._lag < interval:
+            self._skipped_frames = 0
+            return True
+        if self._skipped_frames < _MAX_SKIPPED_FRAMES:
+            self._skipped_frames += 1
+            return False
+        self._skipped_frames = 0
+        self._lag = 0.0
+        return True
+
+
+    def _tick_game(self) -> None:
+        'Runs one step of the game logic, timing each phase if profiling.'
+        game = self._game
+        profiler = self._profiler
+        if profiler == None:
+            game.process_command('')
+            game.check_horizontal_match()
+            game.check_vertical_match()
+            game.check_diagonal_match()
+            game.check_game_over()
+            if not game.game_over():
+                game.create_random_faller()
+        else:
+            tick_start = profiler.start()
+            profiler.time('process_command', game.process_command, '')
+            profiler.time('check_horizontal_match', game.check_horizontal_match)
+            profiler.time('check_vertical_match', game.check_vertical_match)
+            profiler.time('check_diagonal_match', game.check_diagonal_match)
+            profiler.time('check_game_over', game.check_game_over)
+            if not game.game_over():
+                profiler.time('create_random_faller', game.create_random_faller)
+            profiler.stop('tick', tick_start)
 
 
     def _create_surface(self, size: tuple[int, int]) -> None:
         'Creates a pygame surface to display the game on'
         self._surface = pygame.display.set_mode(size, pygame.RESIZABLE)
+        # Every cell is drawn by copying a pre-rendered image of its state at
+        # its size in pixels; the images are rendered again for a new size.
+        self._sprites = {}
+
+        # The pixel edges of the columns and rows of cells, one more than there
+        # are columns and rows. Each edge is rounded down on its own, so cells
+        # meet without gaps and differ in size by at most a pixel.
+        width, height = self._surface.get_size()
+        self._column_edges = [col * width // self._columns for col in range(self._columns + 1)]
+        self._row_edges = [row * height // self._rows for row in range(self._rows + 1)]
 
 
     def _handle_events(self) -> None:
@@ -79,6 +212,15 @@ class ColumnsGUI:
             self._stop_running()
         elif event.type == pygame.VIDEORESIZE:
             self._create_surface(event.size)
+            self._full_redraw = True
+        elif event.type in _EXPOSE_EVENTS:
+            self._full_redraw = True
+        elif event.type == pygame.KEYDOWN and event.key == _PROFILE_KEY:
+            self._toggle_profile()
+        elif event.type == pygame.KEYDOWN and event.key == _LEVEL_UP_KEY:
+            self._change_level(1)
+        elif event.type == pygame.KEYDOWN and event.key == _LEVEL_DOWN_KEY:
+            self._change_level(-1)
         elif event.type == pygame.KEYDOWN:
             self._handle_keys()
             
@@ -97,6 +239,32 @@ class ColumnsGUI:
             self._game.rotate_faller()
 
 
+    def _toggle_profile(self) -> None:
+        'Shows or hides the profile overlay, and starts profiling if it is not on yet.'
+        if self._profiler == None:
+            self._profiler = columns_profiling.TickProfiler()
+        self._show_profile = not self._show_profile
+        self._full_redraw = True
+
+
+    def _set_level(self, level: int) -> None:
+        'Sets the level, and with it how many logic ticks run per second.'
+        self._level = max(1, min(len(_TICK_RATES), level))
+        self._tick_interval = 1 / _TICK_RATES[self._level - 1]
+
+
+    def _change_level(self, step: int) -> None:
+        'Moves the level up or down by the given number of levels, keeping any progress towards the next tick.'
+        self._set_level(self._level + step)
+        self._lag = min(self._lag, self._tick_interval)
+        self._show_level()
+
+
+    def _show_level(self) -> None:
+        'Shows the level and tick rate in the window title.'
+        pygame.display.set_caption(f'{_CAPTION} - level {self._level} ({1 / self._tick_interval:g} ticks/s)')
+
+
     def _stop_running(self) -> None:
         'Stops running the game.'
         self._running = False
@@ -112,74 +280,116 @@ class ColumnsGUI:
         pygame.display.flip()
 
 
-    def _draw_frame(self) -> None:
-        'Draws the current game state.'
+    def _draw_frame(self) -> list[pygame.Rect] | None:
+        '''Draws the cells that changed since the last frame and returns their rects, or draws the whole game
+        state and returns None when everything needs drawing again.'''
+        changes = self._game.consume_changes()
+        # The profile overlay changes every frame and covers part of the field.
+        if self._full_redraw or self._show_profile:
+            self._full_redraw = False
+            self._draw_field()
+            return None
+
+        # The images include the background, so drawing one over a cell also
+        # clears whatever was there.
+        column_edges = self._column_edges
+        row_edges = self._row_edges
+        blits = []
+        for row, col, old_cell, new_cell in changes:
+            if row < _HIDDEN_ROWS:
+                continue
+            row -= _HIDDEN_ROWS
+            x = column_edges[col]
+            y = row_edges[row]
+            blits.append((self._sprite(new_cell, column_edges[col + 1] - x, row_edges[row + 1] - y), (x, y)))
+        return self._surface.blits(blits)
+
+
+    def _draw_field(self) -> None:
+        'Draws the whole game state.'
         self._surface.fill(_BACKGROUND_COLOR)
 
-        game_field = self._game.game_field()
-        for row in range(_NUM_ROWS):
-            for col in range(_NUM_COLUMNS):
-                top_left_frac_x = col / _NUM_COLUMNS
-                top_left_frac_y = row / _NUM_ROWS
-
-                top_left_pixel_x = self._frac_x_to_pixel_x(top_left_frac_x)
-                top_left_pixel_y = self._frac_y_to_pixel_y(top_left_frac_y)
-
-                rect_width_pixel = self._frac_x_to_pixel_x(_COLUMN_WIDTH)
-                rect_height_pixel = self._frac_y_to_pixel_y(_ROW_HEIGHT)
-
-                self._draw_jewel(game_field[row][col], top_left_pixel_x, top_left_pixel_y, \
-                                 rect_width_pixel, rect_height_pixel)
-                
-        pygame.display.flip()
-
-
-    def _draw_jewel(self, jewel_letter: str, pixel_x: int, pixel_y: int, width: int, height: int):
-        'Draws a jewel in the given position and according to what jewel letter it is.'
-        jewel_rect = pygame.Rect(pixel_x, pixel_y, width, height)
-        
-        if jewel_letter.startswith('|'):
-            pygame.draw.rect(self._surface, _FALLER_LANDED_COLOR, jewel_rect)
-
-        if jewel_letter.startswith('*'):
-            pygame.draw.rect(self._surface, _MATCHING_COLOR, jewel_rect)
-            
-        if jewel_letter[1] == 'S':
-            pygame.draw.ellipse(self._surface, _S_COLOR, jewel_rect)
+        column_edges = self._column_edges
+        row_edges = self._row_edges
+        blits = []
+        for row, cells in enumerate(self._game.game_field()):
+            y = row_edges[row]
+            height = row_edges[row + 1] - y
+            for col, cell in enumerate(cells):
+                if cell != _EMPTY_CELL:
+                    x = column_edges[col]
+                    blits.append((self._sprite(cell, column_edges[col + 1] - x, height), (x, y)))
+        self._surface.blits(blits, doreturn=False)
 
-        if jewel_letter[1] == 'T':
-            pygame.draw.ellipse(self._surface, _T_COLOR, jewel_rect)
 
-        if jewel_letter[1] == 'V':
-            pygame.draw.ellipse(self._surface, _V_COLOR, jewel_rect)
+    def _sprite(self, cell: str, width: int, height: int) -> pygame.Surface:
+        'Returns the image of a cell in the given state and size, rendering it the first time it is needed.'
+        key = (cell, width, height)
+        sprite = self._sprites.get(key)
+        if sprite == None:
+            sprite = self._sprites[key] = self._render_cell(cell, width, height)
+        return sprite
 
-        if jewel_letter[1] == 'W':
-            pygame.draw.ellipse(self._surface, _W_COLOR, jewel_rect)
 
-        if jewel_letter[1] == 'X':
-            pygame.draw.ellipse(self._surface, _X_COLOR, jewel_rect)
+    def _update_display(self, rects: list[pygame.Rect] | None) -> None:
+        'Shows the given rects of the surface on the screen, or all of it if None.'
+        if rects == None:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
 
-        if jewel_letter[1] == 'Y':
-            pygame.draw.ellipse(self._surface, _Y_COLOR, jewel_rect)
 
-        if jewel_letter[1] == 'Z':
-            pygame.draw.ellipse(self._surface, _Z_COLOR, jewel_rect)
-        
+    def _draw_profile(self) -> None:
+        'Draws the recent timings of each phase of the game loop over the field.'
+        if self._profile_font == None:
+            self._profile_font = pygame.font.SysFont('monospace', _PROFILE_FONT_SIZE)
+        y = 0
+        for line in self._profiler.summary_lines():
+            text = self._profile_font.render(line, True, _PROFILE_TEXT_COLOR, _BACKGROUND_COLOR)
+            self._surface.blit(text, (0, y))
+            y += text.get_height()
 
-    def _frac_x_to_pixel_x(self, frac_x: float) -> int:
-        'Converts a fractional x-coordinate to a pixel x-coordinate.'
-        return self._frac_to_pixel(frac_x, self._surface.get_width())
 
+    def _render_cell(self, cell: str, width: int, height: int) -> pygame.Surface:
+        'Renders the image of a cell in the given state and size: a jewel over its background, or just the background.'
+        sprite = pygame.Surface((width, height)).convert()
+        sprite.fill(_BACKGROUND_COLOR)
+        jewel_rect = sprite.get_rect()
 
-    def _frac_y_to_pixel_y(self, frac_y: float) -> int:
-        'Converts a fractional y-coordinate to a pixel y-coordinate.'
-        return self._frac_to_pixel(frac_y, self._surface.get_height())
+        if cell.startswith('|'):
+            pygame.draw.rect(sprite, _FALLER_LANDED_COLOR, jewel_rect)
 
+        if cell.startswith('*'):
+            pygame.draw.rect(sprite, _MATCHING_COLOR, jewel_rect)
 
-    def _frac_to_pixel(self, frac: float, max_pixel: int) -> int:
-        'Converts the given fraction to a pixel coordinate.'
-        return int(frac * max_pixel)
+        if cell[1] in _JEWEL_COLORS:
+            pygame.draw.ellipse(sprite, _JEWEL_COLORS[cell[1]], jewel_rect)
+        return sprite
 
 
 if __name__ == '__main__':
-    ColumnsGUI().run()
+    parser = argparse.ArgumentParser(description='Play Columns.')
+    parser.add_argument('--rows', type=int, default=_NUM_ROWS, help='rows in the game field (default: %(default)s)')
+    parser.add_argument('--columns', type=int, default=_NUM_COLUMNS,
+                        help='columns in the game field (default: %(default)s)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='time each phase of the game loop and write the timings to FILE on exit')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write a Chrome trace event timeline of every frame and logic tick to FILE')
+    parser.add_argument('--level', type=int, default=1,
+                        help=f'starting level from 1 to {len(_TICK_RATES)}, which sets the game speed (default: %(default)s)')
+    parser.add_argument('--tick-rate', type=float,
+                        help='logic ticks per second to start with instead of the rate of the level')
+    parser.add_argument('--fps', type=int, default=_FRAME_RATE,
+                        help='frames drawn per second, or 0 for as many as the display takes (default: %(default)s)')
+    args = parser.parse_args()
+    if args.rows < 1 or args.columns < 1:
+        parser.error('the game field needs at least one row and one column')
+    if not 1 <= args.level <= len(_TICK_RATES):
+        parser.error(f'the level must be from 1 to {len(_TICK_RATES)}')
+    if args.tick_rate != None and args.tick_rate <= 0:
+        parser.error('the tick rate must be positive')
+    if args.fps < 0:
+        parser.error('the frame rate cannot be negative')
+    ColumnsGUI(args.rows, args.columns, profile_path=args.profile, trace_path=args.trace, level=args.level,
+               tick_rate=args.tick_rate, frame_rate=args.fps).run()